@@ -0,0 +1,177 @@
+from collections import deque
+from dataclasses import dataclass, field
+
+from graph2LAD import Event, NameCleaner, _clean_str
+
+
+@dataclass
+class AnalysisReport:
+    """
+    Result of analyze, state names are the cleaned names used in the FB
+    """
+    init_state:str
+    unreachable:list = field(default_factory=list)     # states with no path from init_state, export_graph drops them
+    dead_ends:list = field(default_factory=list)       # reachable states without outgoing events
+    non_returning:list = field(default_factory=list)   # cycles (SCCs with several states or a self-loop) of reachable states that can never get back to init_state
+    duplicates:list = field(default_factory=list)      # events repeating an earlier (src, dest, trigger) after cleaning
+    name_collisions:dict = field(default_factory=dict) # cleaned name -> distinct original names
+    long_names:list = field(default_factory=list)      # cleaned names longer than TIA accepts
+
+    @property
+    def ok(self):
+        """
+        False if the exported FB would silently differ from the design,
+        dead ends and non returning states are reported but can be intended
+        """
+        return not (self.unreachable or self.duplicates or self.name_collisions or self.long_names)
+
+    def summary(self):
+        """
+        Human readable list of the findings
+        """
+        lines = []
+        for s in self.unreachable:
+            lines.append('Unreachable state: ' + s)
+        for s in self.dead_ends:
+            lines.append('Dead end state: ' + s)
+        for scc in self.non_returning:
+            lines.append('Cannot return to ' + self.init_state + ': ' + ', '.join(scc))
+        for e in self.duplicates:
+            lines.append('Duplicate event: ' + e.src + ' -> ' + e.dest + ' (' + e.trigger + ')')
+        for name,originals in self.name_collisions.items():
+            lines.append('Name collision: ' + ', '.join(originals) + ' -> ' + name)
+        for name in self.long_names:
+            lines.append('Name too long: ' + name)
+        return lines
+
+
+def analyze(events:list[Event],init_state:str)->AnalysisReport:
+    """
+    Checks a state machine for problems before it is exported,
+    runs in linear time in the number of states and events.
+    events are not modified.
+    """
+    # Clean each distinct name once
+    cleaner = NameCleaner()
+    for e in events:
+        cleaner(e.src)
+        cleaner(e.dest)
+    clean = cleaner.names
+
+    init_state = _clean_str(init_state)
+    report = AnalysisReport(init_state,name_collisions=dict(cleaner.collisions),
+                            long_names=list(cleaner.too_long))
+
+    # Index the cleaned states in order of first appearance
+    index = {}
+    states = []
+    succ = []
+    for e in events:
+        for name in (clean[e.src],clean[e.dest]):
+            if name not in index:
+                index[name] = len(states)
+                states.append(name)
+                succ.append([])
+        succ[index[clean[e.src]]].append(index[clean[e.dest]])
+    n = len(states)
+
+    # Reachability from init_state
+    reachable = [False]*n
+    start = index.get(init_state)
+    if start is not None:
+        reachable[start] = True
+        queue = deque([start])
+        while queue:
+            v = queue.popleft()
+            for w in succ[v]:
+                if not reachable[w]:
+                    reachable[w] = True
+                    queue.append(w)
+
+    report.unreachable = [s for i,s in enumerate(states) if not reachable[i]]
+    report.dead_ends = [s for i,s in enumerate(states) if reachable[i] and len(succ[i]) == 0]
+
+    # States that can get back to init_state, BFS on the reversed graph
+    pred = [[] for _ in range(n)]
+    for v in range(n):
+        for w in succ[v]:
+            pred[w].append(v)
+    returning = [False]*n
+    if start is not None:
+        returning[start] = True
+        queue = deque([start])
+        while queue:
+            v = queue.popleft()
+            for w in pred[v]:
+                if not returning[w]:
+                    returning[w] = True
+                    queue.append(w)
+
+    # Only cycles, a single state that can not return either leads to one or
+    # to a dead end, so listing each of them would bury the summary of a long chain
+    for scc in strongly_connected_components(succ):
+        v = scc[0]
+        if reachable[v] and not returning[v] and (len(scc) > 1 or v in succ[v]):
+            report.non_returning.append([states[v] for v in sorted(scc)])
+
+    seen = set()
+    for e in events:
+        key = (clean[e.src],clean[e.dest],e.trigger)
+        if key in seen:
+            report.duplicates.append(e)
+        else:
+            seen.add(key)
+
+    return report
+
+
+def strongly_connected_components(succ):
+    """
+    Iterative Tarjan, succ[v] is the list of successors of node v.
+    Returns the SCCs as lists of nodes, in reverse topological order
+    """
+    n = len(succ)
+    index = [-1]*n
+    low = [0]*n
+    on_stack = [False]*n
+    stack = []
+    sccs = []
+    counter = 0
+
+    for root in range(n):
+        if index[root] >= 0:
+            continue
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        work = [(root,iter(succ[root]))]
+
+        while work:
+            v,it = work[-1]
+            for w in it:
+                if index[w] < 0:
+                    index[w] = low[w] = counter
+                    counter += 1
+                    stack.append(w)
+                    on_stack[w] = True
+                    work.append((w,iter(succ[w])))
+                    break
+                elif on_stack[w]:
+                    low[v] = min(low[v],index[w])
+            else:
+                work.pop()
+                if work:
+                    u = work[-1][0]
+                    low[u] = min(low[u],low[v])
+                if low[v] == index[v]:
+                    scc = []
+                    while True:
+                        w = stack.pop()
+                        on_stack[w] = False
+                        scc.append(w)
+                        if w == v:
+                            break
+                    sccs.append(scc)
+    return sccs
+
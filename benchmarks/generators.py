@@ -0,0 +1,59 @@
+"""
+Synthetic state machines for the benchmarks.
+State names contain spaces and dashes so that name cleaning has work to do.
+"""
+import random
+
+from graph2LAD import Event
+
+
+def _name(i):
+    return 'State ' + str(i) + '-s'
+
+
+def chain(n):
+    """
+    INIT -> 1 -> 2 -> ... -> n-1, a long sequence
+    """
+    return [Event(_name(i),_name(i+1),'Step ' + str(i) + ' done') for i in range(n-1)]
+
+
+def fan_out(n,width=50):
+    """
+    A tree where every state branches to width new states
+    """
+    return [Event(_name((i-1)//width),_name(i),'Go ' + str(i)) for i in range(1,n)]
+
+
+def mesh(n,degree=8,seed=0):
+    """
+    A chain so that all states are reachable, plus random events between any states
+    """
+    rnd = random.Random(seed)
+    events = chain(n)
+    for i in range(n):
+        for k in range(degree-1):
+            events.append(Event(_name(i),_name(rnd.randrange(n)),'Trigger ' + str(k)))
+    return events
+
+
+def cycles(n,length=20):
+    """
+    A chain of cycles, each state can jump back to the start of its cycle
+    """
+    events = chain(n)
+    for i in range(n):
+        start = i - i % length
+        if start != i:
+            events.append(Event(_name(i),_name(start),'Retry'))
+    return events
+
+
+SHAPES = {
+    'chain': chain,
+    'fan_out': fan_out,
+    'mesh': mesh,
+    'cycles': cycles,
+}
+
+INIT_STATE = _name(0)
@@ -0,0 +1,151 @@
+"""
+Benchmarks of graph2LAD on synthetic state machines.
+Writes the results as JSON, run from the repository root:
+
+    python benchmarks/run_benchmarks.py -o bench.json
+    python benchmarks/run_benchmarks.py --shapes chain mesh --sizes 10 1000
+"""
+import argparse
+import datetime
+import gc
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+
+import graph2LAD
+import generators
+
+SIZES = [10,100,1000,10000,50000]
+
+
+def _measure(fn,repeat,setup=None):
+    """
+    Returns the best wall time of fn over repeat runs and the peak traced memory of one run.
+    With setup, fn is called with a fresh setup() value each run, as some operations
+    modify their input. setup is neither timed nor traced
+    """
+    args = lambda: () if setup is None else (setup(),)
+    best = None
+    for _ in range(repeat):
+        a = args()
+        gc.collect()
+        t0 = time.perf_counter()
+        fn(*a)
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best,dt)
+
+    a = args()
+    gc.collect()
+    tracemalloc.start()
+    fn(*a)
+    _,peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best,peak
+
+
+def _export_phases(events,init_state):
+    """
+    export_graph split into build, indent and write, each phase gets its own tree.
+    Returns build and the (setup, fn) of indent and write for _measure
+    """
+    def build():
+        graph = graph2LAD.TransitionGraph(list(events),clean=True)
+        init = graph2LAD._clean_str(init_state)
+        states = graph.sorted_states(init)
+        root,obj_list,uid = graph2LAD._create_document(states,'Bench',1,deterministic=True)
+        for _ in graph2LAD._iter_networks(obj_list,uid,graph,states,init,'Bench'):
+            pass
+        return root
+
+    def indent(root):
+        ET.indent(root, space="\t", level=0)
+
+    def indented():
+        root = build()
+        indent(root)
+        return root
+
+    def write(root):
+        ET.ElementTree(root).write(io.BytesIO(), encoding='utf-8', xml_declaration=True)
+
+    return build,(build,indent),(indented,write)
+
+
+def run(shapes,sizes,repeat):
+    results = []
+    for shape in shapes:
+        gen = generators.SHAPES[shape]
+        for n in sizes:
+            events = gen(n)
+            init = generators.INIT_STATE
+            cleaned = graph2LAD.clean_names([graph2LAD.Event(e.src,e.dest,e.trigger) for e in events])
+            graph = graph2LAD.TransitionGraph(cleaned,clean=True)
+            init_clean = graph2LAD._clean_str(init)
+
+            build,indent,write = _export_phases(events,init)
+            ops = [
+                ('clean_names', lambda: graph2LAD.clean_names([graph2LAD.Event(e.src,e.dest,e.trigger) for e in events])),
+                ('get_states_sorted', lambda: graph2LAD.get_states_sorted(cleaned,init_clean)),
+                ('export_graph', lambda: graph2LAD.export_graph(graph,init_clean,'Bench',io.BytesIO(),1,deterministic=True)),
+                ('export_graph_streaming', lambda: graph2LAD.export_graph(graph,init_clean,'Bench',io.BytesIO(),1,deterministic=True,streaming=True)),
+                ('export_graph.build', build),
+                ('render_graph.dot', lambda: graph2LAD._create_digraph(graph,init_clean,'bench').source),
+            ]
+
+            for op,fn in ops:
+                seconds,peak = _measure(fn,repeat)
+                results.append(_result(shape,n,len(events),op,seconds,peak))
+                print(shape,n,op,'%.4fs' % seconds,'%.1fMB' % (peak/1e6),flush=True)
+
+            # indent and write are timed and traced on their own, outside of the tree building
+            for op,(setup,fn) in (('export_graph.indent',indent),('export_graph.write',write)):
+                seconds,peak = _measure(fn,repeat,setup)
+                results.append(_result(shape,n,len(events),op,seconds,peak))
+                print(shape,n,op,'%.4fs' % seconds,'%.1fMB' % (peak/1e6),flush=True)
+    return results
+
+
+def _result(shape,n,n_events,op,seconds,peak):
+    return {
+        'shape': shape,
+        'states': n,
+        'events': n_events,
+        'op': op,
+        'seconds': seconds,
+        'peak_bytes': peak,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-o','--output',default='bench_results.json',help='JSON file with the results')
+    parser.add_argument('--shapes',nargs='+',default=list(generators.SHAPES),choices=list(generators.SHAPES))
+    parser.add_argument('--sizes',nargs='+',type=int,default=SIZES,help='number of states')
+    parser.add_argument('--repeat',type=int,default=3,help='timing runs per operation, the best is kept')
+    args = parser.parse_args(argv)
+
+    results = run(args.shapes,args.sizes,args.repeat)
+    report = {
+        'meta': {
+            'graph2LAD_version': graph2LAD.__version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        },
+        'results': results,
+    }
+    with open(args.output,'w',encoding='utf-8') as f:
+        json.dump(report,f,indent=2)
+    print('Wrote ' + args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+import csv
+import itertools
+import json
+import os
+import sys
+
+from graph2LAD import Event
+
+
+# Column names of the event files, in the order of Event,
+# priority is optional and only written when an event has one
+FIELDS = ['src','dest','trigger','priority']
+
+_FORMATS = {'.csv':'csv','.json':'json','.yaml':'yaml','.yml':'yaml'}
+
+
+def load_events(path,format=None)->list[Event]:
+    """
+    Loads events from a CSV, JSON or YAML file, the format is taken from the
+    file extension unless given. State names and triggers are interned, so
+    the same name is stored once however many events use it.
+    Raises ValueError with the file and line/entry of the first invalid event
+    """
+    format = format or _format_of(path)
+    if format == 'csv':
+        return list(iter_events_csv(path))
+    if format == 'json':
+        with open(path,encoding='utf-8') as f:
+            data = json.load(f)
+    elif format == 'yaml':
+        data = _load_yaml(path)
+    else:
+        raise ValueError('Unknown event file format: ' + str(format))
+
+    if isinstance(data,dict):
+        data = data.get('events')
+    if not isinstance(data,list):
+        raise ValueError(str(path) + ': expected a list of events')
+    return [_event(d,path,i) for i,d in enumerate(data)]
+
+
+def iter_events_csv(path,delimiter=None):
+    """
+    Yields the events of a CSV file one row at a time.
+    The first row is a header if it names the columns src, dest and trigger,
+    and optionally priority, other columns are ignored. Without a header the
+    first three columns are used, and a fourth as priority if there is one.
+    The delimiter is ',' or ';' (spreadsheet exports), detected from the first line
+    """
+    intern = sys.intern
+    with open(path,encoding='utf-8-sig',newline='') as f:
+        first = f.readline()
+        if delimiter is None:
+            delimiter = ';' if first.count(';') > first.count(',') else ','
+        f.seek(0)
+
+        rows = csv.reader(f,delimiter=delimiter)
+        header = next(rows,None)
+        if header is None:
+            return
+        names = [h.strip().lower() for h in header]
+        if all(c in names for c in FIELDS[:3]):
+            cols = [names.index(c) for c in FIELDS[:3]]
+            prio = names.index('priority') if 'priority' in names else None
+            first = []
+        else:
+            cols = [0,1,2]
+            prio = 3 if len(header) > 3 else None
+            first = [header]
+
+        n = max(cols) + 1
+        for row in itertools.chain(first,rows):
+            if len(row) == 0 or (len(row) == 1 and row[0].strip() == ''):
+                continue
+            if len(row) < n:
+                raise ValueError(str(path) + ':' + str(rows.line_num) + ': expected ' + str(n) + ' columns, got ' + str(len(row)))
+            src,dest,trigger = [row[c] for c in cols]
+            if src.strip() == '' or dest.strip() == '':
+                raise ValueError(str(path) + ':' + str(rows.line_num) + ': empty state name')
+            priority = 0
+            if prio is not None and prio < len(row) and row[prio].strip() != '':
+                try:
+                    priority = int(row[prio])
+                except ValueError:
+                    raise ValueError(str(path) + ':' + str(rows.line_num) + ': priority is not an integer: ' + row[prio])
+            yield Event(intern(src),intern(dest),intern(trigger),priority)
+
+
+def write_events(events:list[Event],path,format=None):
+    """
+    Writes events to a CSV, JSON or YAML file that load_events reads back unchanged
+    """
+    format = format or _format_of(path)
+    n = 4 if any(e.priority != 0 for e in events) else 3
+    if format == 'csv':
+        with open(path,'w',encoding='utf-8',newline='') as f:
+            w = csv.writer(f)
+            w.writerow(FIELDS[:n])
+            w.writerows((e.src,e.dest,e.trigger,e.priority)[:n] for e in events)
+        return
+
+    if format == 'json':
+        # One [src, dest, trigger] per line, the same as the events of load_jobs
+        with open(path,'w',encoding='utf-8') as f:
+            f.write('[\n')
+            f.write(',\n'.join(json.dumps([e.src,e.dest,e.trigger,e.priority][:n],ensure_ascii=False) for e in events))
+            f.write('\n]\n')
+    elif format == 'yaml':
+        # JSON strings are valid YAML flow scalars
+        with open(path,'w',encoding='utf-8') as f:
+            for e in events:
+                f.write('- ' + json.dumps([e.src,e.dest,e.trigger,e.priority][:n],ensure_ascii=False) + '\n')
+    else:
+        raise ValueError('Unknown event file format: ' + str(format))
+
+
+def _format_of(path):
+    ext = os.path.splitext(str(path))[1].lower()
+    if ext not in _FORMATS:
+        raise ValueError('Cannot tell the format of ' + str(path) + ', use .csv, .json or .yaml')
+    return _FORMATS[ext]
+
+
+def _load_yaml(path):
+    try:
+        import yaml
+    except ImportError:
+        raise ImportError('Reading YAML event files requires PyYAML, pip install pyyaml')
+    with open(path,encoding='utf-8') as f:
+        return yaml.load(f,Loader=getattr(yaml,'CSafeLoader',yaml.SafeLoader))
+
+
+def _event(d,path,i):
+    """
+    Creates an Event from [src, dest, trigger(, priority)] or
+    {'src':..,'dest':..,'trigger':..,'priority':..},
+    i is the position in the file for error messages
+    """
+    intern = sys.intern
+    if isinstance(d,dict):
+        d = (d.get('src'),d.get('dest'),d.get('trigger',''),d.get('priority',0))
+    if not isinstance(d,(list,tuple)) or len(d) not in (3,4):
+        raise ValueError(str(path) + ', entry ' + str(i) + ': expected [src, dest, trigger], got ' + repr(d))
+    src,dest,trigger = d[:3]
+    priority = d[3] if len(d) == 4 else 0
+    if not (isinstance(src,str) and isinstance(dest,str) and src.strip() and dest.strip()):
+        raise ValueError(str(path) + ', entry ' + str(i) + ': state names must be non-empty strings, got ' + repr(d))
+    if not isinstance(priority,int) or isinstance(priority,bool):
+        raise ValueError(str(path) + ', entry ' + str(i) + ': priority is not an integer: ' + repr(priority))
+    return Event(intern(src),intern(dest),intern(str(trigger)),priority)
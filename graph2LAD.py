@@ -1,35 +1,542 @@
 
 import xml.etree.ElementTree as ET
-from dataclasses import dataclass
-import graphviz
+from array import array
+from dataclasses import dataclass, field
+import contextlib
+import copy
 import datetime
+import functools
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import sys
+import time
+import traceback
 
-@dataclass
+__version__ = '1.0'
+
+# Fixed creation time written to every document
+_CREATED = '2021-09-01T12:00:00'
+
+# Default languages of titles and comments
+CULTURES = ['sv-SE','de-DE','en-US','es-ES','fr-FR','it-IT','ja-JP','zh-CN']
+
+
+@dataclass(slots=True)
 class Event:
     """
     Represents a transition between two states in a state machine
+    When several transitions of a state fire in the same cycle, the one with
+    the highest priority wins, and of equal priorities the later event
     """
     src:str
     dest:str
     trigger:str
+    priority:int = 0
 
     def __hash__(self) -> int:
-        return hash((self.src,self.dest,self.trigger))
+        return hash((self.src,self.dest,self.trigger,self.priority))
+
+    def freeze(self):
+        """
+        Returns the event as an immutable FrozenEvent
+        """
+        return FrozenEvent(self.src,self.dest,self.trigger,self.priority)
+
+
+@dataclass(frozen=True,slots=True)
+class FrozenEvent:
+    """
+    Immutable Event, the names are interned so each distinct name is stored once
+    and compared by identity. Used for cleaned events, which are never modified
+    """
+    src:str
+    dest:str
+    trigger:str
+    priority:int = 0
+
+    def __post_init__(self):
+        object.__setattr__(self,'src',sys.intern(self.src))
+        object.__setattr__(self,'dest',sys.intern(self.dest))
+        object.__setattr__(self,'trigger',_trigger_str(self.trigger))
+
+    def freeze(self):
+        return self
+
+
+def _trigger_str(trigger):
+    """
+    Trigger as an interned string, None is no trigger and other values,
+    e.g. numbers from a job file, are converted like event_io does
+    """
+    return sys.intern('' if trigger is None else str(trigger))
+
+
+class EventTable:
+    """
+    Events stored as integer IDs, each state name and trigger is stored once,
+    and an event takes 16 bytes in four arrays instead of an object.
+    Iterating gives FrozenEvent, so a table can be passed anywhere an event list is
+    """
+    def __init__(self,events=()):
+        self.names = []     # state name of each state ID
+        self.triggers = []  # trigger of each trigger ID
+        self.src = array('i')
+        self.dest = array('i')
+        self.trigger = array('i')
+        self.priority = array('i')
+        self._name_ids = {}
+        self._trigger_ids = {}
+        for e in events:
+            self.add(e.src,e.dest,e.trigger,e.priority)
+
+    def add(self,src,dest,trigger,priority=0):
+        """
+        Appends an event, returns its index
+        """
+        self.src.append(self.state_id(src))
+        self.dest.append(self.state_id(dest))
+        trigger = _trigger_str(trigger)
+        t = self._trigger_ids.get(trigger)
+        if t is None:
+            t = len(self.triggers)
+            self._trigger_ids[trigger] = t
+            self.triggers.append(trigger)
+        self.trigger.append(t)
+        self.priority.append(priority)
+        return len(self.src) - 1
+
+    def state_id(self,name):
+        """
+        Returns the ID of a state name, adding it if it is new
+        """
+        i = self._name_ids.get(name)
+        if i is None:
+            i = len(self.names)
+            self._name_ids[name] = i
+            self.names.append(sys.intern(name))
+        return i
+
+    def __len__(self):
+        return len(self.src)
+
+    def __getitem__(self,i):
+        return FrozenEvent(self.names[self.src[i]],self.names[self.dest[i]],self.triggers[self.trigger[i]],self.priority[i])
+
+    def __iter__(self):
+        names = self.names
+        triggers = self.triggers
+        for s,d,t,p in zip(self.src,self.dest,self.trigger,self.priority):
+            yield FrozenEvent(names[s],names[d],triggers[t],p)
+
+
+class TransitionGraph:
+    """
+    Compiled, indexed view of a state machine
+    Built once from the event list and reused by export_graph, render_graph,
+    get_states and get_states_sorted instead of rescanning the events
+    """
+    def __init__(self,events,clean=False):
+        # Names cleaned so far, with collisions and too long names
+        self.cleaner = NameCleaner() if clean else None
+        if clean:
+            events = cleaned_events(events,self.cleaner)
+        self.events = list(events)
+        self.cleaned = clean
+
+        # states in order of first appearance, and state -> index
+        self.states = []
+        self.index = {}
+        # outgoing events per state index, in event list order
+        self.outgoing = []
+
+        self.prioritized = False
+        for e in self.events:
+            src = self._add_state(e.src)
+            self._add_state(e.dest)
+            self.outgoing[src].append(e)
+            if e.priority != 0:
+                self.prioritized = True
+
+    def _add_state(self,name):
+        i = self.index.get(name)
+        if i is None:
+            i = len(self.states)
+            self.index[name] = i
+            self.states.append(name)
+            self.outgoing.append([])
+        return i
+
+    def __contains__(self,state):
+        return state in self.index
+
+    def __len__(self):
+        return len(self.states)
+
+    def outgoing_events(self,state):
+        """
+        Returns the outgoing events of a state, empty if the state is unknown
+        """
+        i = self.index.get(state)
+        if i is None:
+            return []
+        return self.outgoing[i]
+
+    def transitions(self,state):
+        """
+        Returns the outgoing events of a state in network order, by ascending
+        priority and in event list order within a priority. The last transition
+        that fires wins, which is the first in the reversed order
+        """
+        out = self.outgoing_events(state)
+        if not self.prioritized:
+            return out
+        return sorted(out,key=lambda e: e.priority)
+
+    def sorted_states(self,init_state):
+        """
+        Depth first ordering of the states reachable from init_state,
+        same order as the recursive dive but without the recursion limit
+        """
+        visited = {init_state}
+        order = [init_state]
+        stack = [iter(self.outgoing_events(init_state))]
+        while stack:
+            for e in stack[-1]:
+                if e.dest not in visited:
+                    visited.add(e.dest)
+                    order.append(e.dest)
+                    stack.append(iter(self.outgoing_events(e.dest)))
+                    break
+            else:
+                stack.pop()
+        return order
+
+
+def _as_graph(events,clean=False):
+    """
+    Returns a TransitionGraph for events, reusing it if it already is one
+    """
+    if isinstance(events,TransitionGraph):
+        if clean and not events.cleaned:
+            return TransitionGraph(events.events,clean=True)
+        return events
+    return TransitionGraph(events,clean=clean)
+
+
+class ExportProfile:
+    """
+    Collects what export_graph and render_graph spend their time on.
+    Pass it as profile= and read profile.report() afterwards, the same
+    profile can be passed to several exports. callback, if given, is
+    called with every record as soon as it is complete.
+    Phase records: phase, context (block title or file), seconds and where
+    known elements, bytes and uid_high_water (last ID of the block counter).
+    Network records: network (title), context, seconds, elements,
+    local_uid_high_water, uid_high_water and, when streaming, bytes and write_seconds.
+    """
+    def __init__(self,callback=None):
+        self.callback = callback
+        self.context = None
+        self.phases = []
+        self.networks = []
+
+    @contextlib.contextmanager
+    def phase(self,name):
+        """
+        Times a phase, more data can be added to the yielded record
+        """
+        record = {'phase':name,'context':self.context}
+        t0 = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - t0
+            self.phases.append(record)
+            if self.callback is not None:
+                self.callback(record)
+
+    def network(self,name,seconds,network,uid):
+        """
+        Records a generated network, network is an element or serialized XML
+        """
+        if isinstance(network,str):
+            elements = network.count('<') - network.count('</')
+            uids = [int(u) for u in re.findall(r' UId="(\d+)"',network)]
+        else:
+            elements = 0
+            uids = []
+            for el in network.iter():
+                elements += 1
+                if 'UId' in el.attrib:
+                    uids.append(int(el.attrib['UId']))
+        record = {
+            'network':name,
+            'context':self.context,
+            'seconds':seconds,
+            'elements':elements,
+            'local_uid_high_water':max(uids,default=None),
+            'uid_high_water':uid.uid - 1,
+        }
+        self.networks.append(record)
+        if self.callback is not None:
+            self.callback(record)
+        return record
+
+    def report(self):
+        """
+        Returns the collected data as a dict that can be written as JSON
+        """
+        return {
+            'phases':list(self.phases),
+            'networks':list(self.networks),
+            'total_seconds':sum(p['seconds'] for p in self.phases),
+            'bytes_written':sum(p.get('bytes',0) for p in self.phases),
+            'slowest_networks':sorted(self.networks,key=lambda n: n['seconds'],reverse=True)[:10],
+        }
+
+
+class _NoProfile(ExportProfile):
+    """
+    Profile that records nothing, used when no profile is given
+    """
+    def phase(self,name):
+        return contextlib.nullcontext({})
 
+    def network(self,name,seconds,network,uid):
+        return None
 
 
-def export_graph(events:list[Event],init_state:str,title:str,fname:str,fb_nr):
+class _CountingWriter:
+    """
+    Binary file wrapper that counts the bytes written
+    """
+    def __init__(self,f):
+        self.f = f
+        self.bytes = 0
+
+    def write(self,b):
+        self.bytes += len(b)
+        return self.f.write(b)
+
+
+def export_graph(events:list[Event],init_state:str,title:str,fname:str,fb_nr,streaming=False,language='LAD',
+                 deterministic=False,cache_dir=None,cultures=None,profile=None,instrument=False,
+                 split=None,sub_fb_nr=None,state_flags=False,stations=None,station_db_nr=None,
+                 station_db=None):
     """
     Exports a state machine to a simatic ML file that can be imported to TIA portal
+    events can be a list of Event or a prebuilt TransitionGraph
+    fname is a file name without the .xml extension or a writable binary file object,
+    with fname=None the XML is returned as bytes
+    With streaming=True each network is written as soon as it is generated,
+    which keeps memory constant for large state machines, the output is the same
+    language selects how the steps are generated:
+        'LAD' - one LAD network with a compare per step
+        'SCL' - a single SCL network with a CASE statement over statStep
+    deterministic=True writes a fixed date in the block comment, so the same
+    input always gives the same file
+    With cache_dir set the output is deterministic and stored in cache_dir keyed
+    on a hash of the input, unchanged state machines are copied from the cache
+    instead of being regenerated, and an unchanged output file is not rewritten
+    cultures is the list of languages of titles and comments, default CULTURES,
+    e.g. ['en-US'] for a single language
+    profile is an ExportProfile that records time, element counts, bytes
+    and ID counters per phase and per network
+    The transitions of a state are evaluated by Event.priority. In LAD all
+    branches of a step network are evaluated and the last one that fires
+    wins, so they are ordered by ascending priority. LAD gets the priority
+    order only, there is no early exit: every step network and every branch
+    is evaluated each cycle. SCL uses an IF/ELSIF chain by descending priority
+    that stops at the first one that fires, in the CASE branch of the active step
+    Raises ValueError if distinct state names are cleaned to the same TIA name
+    or are longer than MAX_NAME_LENGTH
+    instrument=True adds an instrumentation network that counts the entries of
+    each state, accumulates the time spent in each state and records the step
+    each state was last entered from, in arrays indexed by step value / 10
+    split divides a large state machine into sub-FBs, grouping the states like
+    the cluster argument of render_graph ('scc', 'prefix', a dict or a function).
+    States in a group of their own join the group of init_state. The FB fb_nr
+    calls the sub-FBs as multi-instances and dispatches with a CASE over the
+    step ranges to the one that holds the active step. The sub-FBs get the
+    numbers sub_fb_nr, sub_fb_nr + 1, ... (default fb_nr + 1) and are written
+    to fname_1.xml, fname_2.xml, ... States are numbered group by group.
+    split cannot be combined with cache_dir
+    state_flags adds outputs for HMI/SCADA polling: stateFlags, an array of
+    'DWord' (True) or 'Word' with the bit of the active state set, bit
+    step / 10 counted from bit 0 of the first word, and transitionCount, which
+    is incremented each time the flags change. A client can read
+    transitionCount alone and only fetch the flags when it has changed
+    stations=n runs n identical state machines in one FB: enable and reset
+    are inputs and statStep and statNextStep static members of
+    Array[0..n-1], and a single SCL network loops over the stations with
+    reset, CASE and next step of each, the language is always SCL. The
+    instance DB, numbered station_db_nr (default fb_nr), is written to
+    station_db, a file name without .xml or a writable binary file object,
+    by default fname_DB.xml. With fname=None or a file object station_db must
+    be given. stations cannot be combined with split, instrument or state_flags
+    """
+    if language not in ('LAD','SCL'):
+        raise ValueError('Unknown language: ' + str(language))
+    state_flags = _state_flags_type(state_flags)
+    if stations is not None:
+        stations = int(stations)
+        if stations < 1:
+            raise ValueError('stations must be at least 1, got ' + str(stations))
+        if split is not None or instrument or state_flags:
+            raise ValueError('stations cannot be combined with split, instrument or state_flags')
+        if station_db is None:
+            if fname is None or hasattr(fname,'write'):
+                raise ValueError('stations writes an instance DB too, station_db must be given '
+                                 'when fname is not a file name')
+            station_db = fname + '_DB'
+        station_db_nr = fb_nr if station_db_nr is None else station_db_nr
+    elif station_db is not None:
+        raise ValueError('station_db is only written with stations')
+    if fname is None:
+        if split is not None:
+            raise ValueError('split writes one file per FB, fname must be a file name')
+        out = io.BytesIO()
+        export_graph(events,init_state,title,out,fb_nr,streaming=streaming,language=language,
+                     deterministic=deterministic,cache_dir=cache_dir,cultures=cultures,profile=profile,
+                     instrument=instrument,state_flags=state_flags,stations=stations,
+                     station_db_nr=station_db_nr,station_db=station_db)
+        return out.getvalue()
+    if cultures is None:
+        cultures = CULTURES
+    prof = profile if profile is not None else _NoProfile()
+    prof.context = title
+
+    with prof.phase('clean_names') as rec:
+        graph = _as_graph(events,clean=True)
+        init_state = _clean_str(init_state)
+        rec['states'] = len(graph.states)
+        rec['events'] = len(graph.events)
+        graph.cleaner.check()
+        if len(_clean_str(title)) > MAX_NAME_LENGTH:
+            raise ValueError('Title is longer than ' + str(MAX_NAME_LENGTH) + ' characters: ' + title)
+
+    if split is not None:
+        if cache_dir is not None:
+            raise ValueError('split cannot be combined with cache_dir')
+        if hasattr(fname,'write'):
+            raise ValueError('split writes one file per FB, fname must be a file name')
+        with prof.phase('split') as rec:
+            groups = _split_groups(graph,init_state,split)
+            rec['groups'] = len(groups)
+        if len(groups) > 1:
+            sub_fb_nr = int(fb_nr) + 1 if sub_fb_nr is None else int(sub_fb_nr)
+            _export_split(graph,groups,init_state,title,fname,fb_nr,sub_fb_nr,streaming,language,
+                          deterministic,cultures,profile,instrument,state_flags)
+            return
+
+    if cache_dir is not None:
+        # Arguments that change the generated XML
+        options = {'language':language,'cultures':list(cultures),'instrument':instrument,
+                   'state_flags':state_flags,'stations':stations}
+        if stations is not None:
+            options['station_db_nr'] = station_db_nr
+        with prof.phase('cache') as rec:
+            key = _cache_key(graph,init_state,title,fb_nr,options)
+            cached = os.path.join(cache_dir, key + '.xml')
+            # The instance DB of stations is cached next to the FB
+            cached_db = os.path.join(cache_dir, key + '_DB.xml') if stations is not None else None
+            hit = os.path.exists(cached) and (cached_db is None or os.path.exists(cached_db))
+            rec['hit'] = hit
+        if not hit:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp = cached + '.' + str(os.getpid()) + '.tmp'
+            tmp_db = cached_db + '.' + str(os.getpid()) + '.tmp' if cached_db is not None else None
+            with open(tmp,'wb') as f, (open(tmp_db,'wb') if tmp_db is not None else contextlib.nullcontext()) as db:
+                export_graph(graph,init_state,title,f,fb_nr,streaming=streaming,deterministic=True,
+                             profile=profile,station_db=db,**options)
+            if tmp_db is not None:
+                os.replace(tmp_db,cached_db)
+            os.replace(tmp,cached)
+        with prof.phase('copy_cached'):
+            _copy_cached(cached,fname)
+            if cached_db is not None:
+                _copy_cached(cached_db,station_db)
+        return
+
+    with prof.phase('sort_states') as rec:
+        states = graph.sorted_states(init_state)
+        rec['states'] = len(states)
+
+    with prof.phase('interface') as rec:
+        root,obj_list,uid = _create_document(states,title,fb_nr,cultures,deterministic,instrument,
+                                             state_flags=state_flags,stations=stations)
+        if profile is not None:
+            rec['elements'] = sum(1 for _ in root.iter())
+            rec['uid_high_water'] = uid.uid - 1
+
+    networks = _iter_networks(obj_list,uid,graph,states,init_state,title,language,cultures,
+                              as_text=streaming,profile=profile,instrument=instrument,state_flags=state_flags,
+                              stations=stations)
+    _write_document(root,obj_list,uid,networks,fname,streaming,profile)
+
+    if stations is not None:
+        with prof.phase('instance_db'):
+            _write_station_db(title,station_db,station_db_nr,stations,cultures,deterministic)
+
+
+def _write_document(root,obj_list,uid,networks,fname,streaming=False,profile=None):
     """
-    events = clean_names(events)
-    init_state = _clean_str(init_state)
+    Generates the networks into the document and writes it to fname
+    """
+    prof = profile if profile is not None else _NoProfile()
+
+    if streaming:
+        with prof.phase('networks_streamed') as rec:
+            rec['bytes'] = _stream_document(root,obj_list,networks,fname,profile)
+            rec['uid_high_water'] = uid.uid - 1
+        return
+
+    with prof.phase('networks') as rec:
+        for _ in networks:
+            pass
+        rec['uid_high_water'] = uid.uid - 1
+        if profile is not None:
+            rec['elements'] = sum(1 for _ in obj_list.iter()) - 1
 
+    tree = ET.ElementTree(root)
+    with prof.phase('indent'):
+        ET.indent(tree, space="\t", level=0)
+    with prof.phase('write') as rec:
+        target = _output_target(fname)
+        f = target if hasattr(target,'write') else open(target,'wb')
+        try:
+            out = _CountingWriter(f)
+            tree.write(out, encoding='utf-8', xml_declaration=True)
+            rec['bytes'] = out.bytes
+        finally:
+            if f is not target:
+                f.close()
+
+
+def _create_document(states,title,fb_nr,cultures=CULTURES,deterministic=False,instrument=False,
+                     values=None,sub=False,instances=(),n_steps=None,state_flags=None,stations=None):
+    """
+    Creates the document with the FB interface and block comment, without networks.
+    states are the sorted states, that get a constant each, with the step values
+    in values or i*10.
+    instrument=True adds the members of the instrumentation network, with arrays
+    for n_steps states (default len(states)).
+    sub=True creates the interface of a sub-FB of a split export, which works on
+    statStep and statNextStep of the calling FB as InOut.
+    instances are the (name, FB name, bytes) of multi-instances in Static.
+    state_flags is None, 'Word' or 'DWord', the word type of the stateFlags output.
+    stations=n makes enable, reset, statStep and statNextStep arrays of n stations.
+    Returns the root, the ObjectList the networks go to and the ID counter
+    """
     root = ET.Element("Document") 
     ET.SubElement(root, "Engineering").attrib['version'] = 'V17'
     
     docinfo = ET.SubElement(root, "DocumentInfo")
-    ET.SubElement(docinfo, "Created").text = '2021-09-01T12:00:00'
+    ET.SubElement(docinfo, "Created").text = _CREATED
     ET.SubElement(docinfo, "ExportSetting").text = 'None'
 
     inst_prods = ET.SubElement(docinfo, "InstalledProducts")
@@ -49,25 +556,43 @@ def export_graph(events:list[Event],init_state:str,title:str,fname:str,fb_nr):
     inp_section = ET.SubElement(sections, "Section")
     inp_section.attrib['Name'] = 'Input'
 
-    enable_inp = _create_member(inp_section,'enable','Bool')
-    _create_multilanguageComment_blk_io(enable_inp,'Enables the state machine')
+    per_station = lambda datatype: datatype if stations is None else 'Array[0..' + str(stations-1) + '] of ' + datatype
 
-    reset_inp = _create_member(inp_section,'reset','Bool')
-    _create_multilanguageComment_blk_io(reset_inp,'Resets to init state')
+    if not sub:
+        enable_inp = _create_member(inp_section,'enable',per_station('Bool'))
+        _create_multilanguageComment_blk_io(enable_inp,'Enables the state machine',cultures)
 
-    ET.SubElement(sections, "Section").attrib['Name'] = 'Output'
-    ET.SubElement(sections, "Section").attrib['Name'] = 'InOut'
+        reset_inp = _create_member(inp_section,'reset',per_station('Bool'))
+        _create_multilanguageComment_blk_io(reset_inp,'Resets to init state',cultures)
+
+    out_section = ET.SubElement(sections, "Section")
+    out_section.attrib['Name'] = 'Output'
+    inout_section = ET.SubElement(sections, "Section")
+    inout_section.attrib['Name'] = 'InOut'
 
     stat_section = ET.SubElement(sections, "Section")
     stat_section.attrib['Name'] = 'Static'
 
-    step0 = _create_member(stat_section,'statStep','Int')
-    _create_multilanguageComment_blk_io(step0,'Current step/state')
+    step_section = inout_section if sub else stat_section
+    step0 = _create_member(step_section,'statStep',per_station('Int'))
+    _create_multilanguageComment_blk_io(step0,'Current step/state',cultures)
+
+    step1 = _create_member(step_section,'statNextStep',per_station('Int'))
+    _create_multilanguageComment_blk_io(step1,'Step/State next PLC cycle',cultures)
+
+    for name,fb_name,_ in instances:
+        _create_member(stat_section,name,'"' + fb_name + '"')
 
-    step1 = _create_member(stat_section,'statNextStep','Int')
-    _create_multilanguageComment_blk_io(step1,'Step/State next PLC cycle')
+    temp_section = ET.SubElement(sections, "Section")
+    temp_section.attrib['Name'] = 'Temp'
 
-    ET.SubElement(sections, "Section").attrib['Name'] = 'Temp'
+    n_steps = len(states) if n_steps is None else n_steps
+    if instrument:
+        _create_instrumentation_members(stat_section,temp_section,n_steps,cultures)
+    if state_flags:
+        _create_state_flags_members(out_section,stat_section,temp_section,n_steps,state_flags,cultures)
+    if stations is not None:
+        _create_member(temp_section,'tempStation','Int')
     #triggs = [e.trigger for e in events]
     #for i,t in enumerate(triggs):
     #    _create_member(stat_section,t,'Bool')
@@ -75,13 +600,12 @@ def export_graph(events:list[Event],init_state:str,title:str,fname:str,fb_nr):
     const_section = ET.SubElement(sections, "Section")
     const_section.attrib['Name'] = 'Constant'
 
-    #states = get_states(events)
-    states = get_states_sorted(events,init_state)
     for i,s in enumerate(states):
-        _create_member(const_section,s,'Int',i*10)
+        _create_member(const_section,s,'Int',i*10 if values is None else values[s])
 
     ET.SubElement(attr_list, "MemoryLayout").text = 'Optimized'
-    ET.SubElement(attr_list, "MemoryReserve").text = '100' # TODO, how to calculate this?
+    size = _interface_bytes(sections) + sum(b for _,_,b in instances)
+    ET.SubElement(attr_list, "MemoryReserve").text = str(_memory_reserve(size))
     ET.SubElement(attr_list, "Name").text = _clean_str(title)
     ET.SubElement(attr_list, "Number").text = str(fb_nr)
     ET.SubElement(attr_list, "ProgrammingLanguage").text = 'LAD'
@@ -90,30 +614,647 @@ def export_graph(events:list[Event],init_state:str,title:str,fname:str,fb_nr):
     obj_list = ET.SubElement(sw, "ObjectList")
     
     # timestamp string : yyyy-mm-dd
-    timestamp_str = datetime.datetime.now().strftime("%Y-%m-%d")
+    if deterministic:
+        timestamp_str = _CREATED[:10]
+    else:
+        timestamp_str = datetime.datetime.now().strftime("%Y-%m-%d")
 
 
     blk_comment = "Auto genereted sequence by graph2LAD: " + timestamp_str + '\n'
     blk_comment += 'E.R. https://github.com/eliasrhoden'
 
-    _create_multilingual_text(obj_list,uid,'Comment',blk_comment)
+    _create_multilingual_text(obj_list,uid,'Comment',blk_comment,cultures)
+
+    return root,obj_list,uid
 
-    # Write networks
-    _write_reset_net(obj_list,uid,init_state)
 
+def _iter_networks(obj_list,uid,graph,states,init_state,title,language='LAD',cultures=CULTURES,
+                   as_text=False,profile=None,instrument=False,sub=False,state_flags=None,stations=None):
+    """
+    Writes the networks and the block title to obj_list,
+    yields each element as soon as it has been created.
+    With as_text=True step networks are not added to obj_list, they are
+    yielded as serialized XML for the streaming writer instead.
+    sub=True writes only the step networks and the title, for a sub-FB.
+    With stations all steps are in the single network of the station loop
+    """
+    done = lambda name,t0,network: _record_network(profile,uid,name,t0,network)
+
+    if stations is not None:
+        t0 = time.perf_counter()
+        steps = [(s,[e.dest for e in graph.transitions(s)]) for s in states]
+        steps = [(s,dests) for s,dests in steps if len(dests) > 0]
+        yield done('Stations',t0,_write_station_network(obj_list,uid,steps,init_state,stations,cultures))
+        t0 = time.perf_counter()
+        _create_multilingual_text(obj_list,uid,'Title',title,cultures)
+        yield done('Title',t0,obj_list[-1])
+        return
+
+    if not sub:
+        t0 = time.perf_counter()
+        _write_reset_net(obj_list,uid,init_state,cultures)
+        yield done('Reset',t0,obj_list[-1])
+
+    steps = []
     for s in states:
 
-        out_evs = get_outgoing_events(events,s)
+        out_evs = graph.transitions(s)
         dest_states = [e.dest for e in out_evs]
         if len(dest_states) > 0:
-            _write_step_network(obj_list,s,dest_states,uid)
+            if language == 'SCL':
+                steps.append((s,dest_states))
+                continue
+
+            # Branches in ascending priority, all are evaluated and the last one that fires wins
+            t0 = time.perf_counter()
+            template = _step_network_template(len(dest_states),tuple(cultures))
+            if as_text:
+                yield done(s,t0,template.render(uid,[s] + dest_states))
+            else:
+                yield done(s,t0,template.instantiate(obj_list,uid,[s] + dest_states))
+
+    if len(steps) > 0:
+        t0 = time.perf_counter()
+        yield done('Steps',t0,_write_case_network(obj_list,uid,steps,cultures))
+
+    if instrument and not sub:
+        t0 = time.perf_counter()
+        yield done('Instrumentation',t0,_write_instrumentation_net(obj_list,uid,cultures))
+
+    if not sub:
+        t0 = time.perf_counter()
+        _write_next_step_net(obj_list,uid,cultures)
+        yield done('Next step',t0,obj_list[-1])
+
+    if state_flags and not sub:
+        t0 = time.perf_counter()
+        yield done('State flags',t0,_write_state_flags_net(obj_list,uid,state_flags,cultures))
+    t0 = time.perf_counter()
+    _create_multilingual_text(obj_list,uid,'Title',title,cultures)
+    yield done('Title',t0,obj_list[-1])
+
+
+def _record_network(profile,uid,name,t0,network):
+    """
+    Records a network generated since t0 in profile, if any, returns the network
+    """
+    if profile is not None:
+        profile.network(name,time.perf_counter() - t0,network,uid)
+    return network
 
-    _write_next_step_net(obj_list,uid)
-    _create_multilingual_text(obj_list,uid,'Title',title )
 
-    tree = ET.ElementTree(root)
-    ET.indent(tree, space="\t", level=0)
-    tree.write(fname + '.xml', encoding='utf-8', xml_declaration=True)
+def _split_groups(graph,init_state,split):
+    """
+    Groups the states reachable from init_state for a split export.
+    Returns the groups as lists of states in exported order, the group of
+    init_state first, single states are added to the group of init_state
+    """
+    states = graph.sorted_states(init_state)
+    group_of = {}
+    for name,members in _state_groups(graph,split).items():
+        if len(members) > 1:
+            for s in members:
+                group_of[s] = name
+
+    main = group_of.get(init_state)
+    groups = {}
+    for s in states:
+        groups.setdefault(group_of.get(s,main),[]).append(s)
+    return list(groups.values())
+
+
+def _export_split(graph,groups,init_state,title,fname,fb_nr,sub_fb_nr,streaming,language,
+                  deterministic,cultures,profile,instrument,state_flags=None):
+    """
+    Writes a split export, one sub-FB per group and the FB that calls them
+    """
+    prof = profile if profile is not None else _NoProfile()
+    states = [s for g in groups for s in g]
+    values = {s:i*10 for i,s in enumerate(states)}
+    name = _clean_str(title)
+
+    instances = []
+    ranges = []
+    for k,group in enumerate(groups):
+        sub_title = title + '_' + str(k+1)
+        prof.context = sub_title
+
+        # Destinations in other groups need a constant too
+        constants = list(group)
+        known = set(group)
+        for s in group:
+            for e in graph.outgoing_events(s):
+                if e.dest not in known:
+                    known.add(e.dest)
+                    constants.append(e.dest)
+
+        with prof.phase('interface'):
+            root,obj_list,uid = _create_document(constants,sub_title,sub_fb_nr + k,cultures,deterministic,
+                                                 values=values,sub=True)
+        networks = _iter_networks(obj_list,uid,graph,group,init_state,sub_title,language,cultures,
+                                  as_text=streaming,profile=profile,sub=True)
+        _write_document(root,obj_list,uid,networks,fname + '_' + str(k+1),streaming,profile)
+
+        instances.append(('statSub' + str(k+1),_clean_str(sub_title),_SUB_FB_BYTES))
+        ranges.append((values[group[0]],values[group[-1]]))
+
+    prof.context = title
+    with prof.phase('interface'):
+        root,obj_list,uid = _create_document([init_state],title,fb_nr,cultures,deterministic,instrument,
+                                             values=values,instances=instances,n_steps=len(states),
+                                             state_flags=state_flags)
+
+    def networks():
+        done = lambda name,t0,network: _record_network(profile,uid,name,t0,network)
+        t0 = time.perf_counter()
+        _write_reset_net(obj_list,uid,init_state,cultures)
+        yield done('Reset',t0,obj_list[-1])
+        t0 = time.perf_counter()
+        yield done('Dispatch',t0,_write_dispatch_network(obj_list,uid,[(i,n) for i,n,_ in instances],ranges,cultures))
+        if instrument:
+            t0 = time.perf_counter()
+            yield done('Instrumentation',t0,_write_instrumentation_net(obj_list,uid,cultures))
+        t0 = time.perf_counter()
+        _write_next_step_net(obj_list,uid,cultures)
+        yield done('Next step',t0,obj_list[-1])
+        if state_flags:
+            t0 = time.perf_counter()
+            yield done('State flags',t0,_write_state_flags_net(obj_list,uid,state_flags,cultures))
+        t0 = time.perf_counter()
+        _create_multilingual_text(obj_list,uid,'Title',title,cultures)
+        yield done('Title',t0,obj_list[-1])
+
+    _write_document(root,obj_list,uid,networks(),fname,streaming,profile)
+
+
+# Sizes in bytes of the interface data types, for the MemoryReserve
+_TYPE_BYTES = {'Bool':1,'Byte':1,'Char':1,'Int':2,'UInt':2,'Word':2,'DInt':4,'UDInt':4,'DWord':4,
+               'Real':4,'Time':4,'LReal':8,'LInt':8,'ULInt':8,'LWord':8,'LTime':8}
+
+# Instance data of a sub-FB, statStep and statNextStep as InOut
+_SUB_FB_BYTES = 4
+
+def _interface_bytes(sections):
+    """
+    Estimates the instance data of an interface in bytes, Temp and Constant take none
+    """
+    size = 0
+    for section in sections:
+        if section.attrib['Name'] in ('Temp','Constant'):
+            continue
+        for m in section.iter('Member'):
+            datatype = m.attrib['Datatype']
+            count = 1
+            match = re.match(r'Array\[(-?\d+)\.\.(-?\d+)\] of (\w+)',datatype)
+            if match:
+                count = int(match.group(2)) - int(match.group(1)) + 1
+                datatype = match.group(3)
+            # Multi-instances are counted by the caller
+            size += count*_TYPE_BYTES.get(datatype,0)
+    return size
+
+
+def _memory_reserve(size):
+    """
+    Memory reserved for changing the interface without reinitializing the
+    instance, the interface size rounded up to 100 bytes and at least 100
+    """
+    return max(100,-(-size//100)*100)
+
+
+def _output_target(fname):
+    """
+    Returns the file the XML is written to,
+    fname is either a file name without extension or a writable binary file object
+    """
+    if hasattr(fname,'write'):
+        return fname
+    return fname + '.xml'
+
+
+def _cache_key(graph,init_state,title,fb_nr,options):
+    """
+    Hash of everything that affects the generated XML,
+    options holds the export_graph arguments that change the output
+    """
+    data = {
+        'version': __version__,
+        'events': [(e.src,e.dest,e.trigger,e.priority) for e in graph.events],
+        'init_state': init_state,
+        'title': title,
+        'fb_nr': str(fb_nr),
+        'options': options,
+    }
+    txt = json.dumps(data, sort_keys=True, ensure_ascii=True)
+    return hashlib.sha256(txt.encode('utf-8')).hexdigest()
+
+
+def _copy_cached(cached,fname):
+    """
+    Copies a cached XML file to the export target,
+    a target file with identical content is left untouched
+    """
+    target = _output_target(fname)
+    if hasattr(target,'write'):
+        with open(cached,'rb') as f:
+            shutil.copyfileobj(f,target)
+        return
+
+    if os.path.exists(target) and os.path.getsize(target) == os.path.getsize(cached):
+        with open(target,'rb') as a, open(cached,'rb') as b:
+            if a.read() == b.read():
+                return
+    shutil.copyfile(cached,target)
+
+
+_STREAM_PLACEHOLDER = 'graph2LAD.Networks'
+
+def _stream_document(root,obj_list,networks,fname,profile=None):
+    """
+    Writes the document with each network serialized as soon as it is created
+    and then dropped from the tree, so memory does not grow with the number of states.
+    The output is identical to indenting and writing the full tree.
+    Returns the number of bytes written
+    """
+    # Serialize everything around the networks once, with a placeholder where they go
+    ET.SubElement(obj_list,_STREAM_PLACEHOLDER)
+    ET.indent(root, space="\t", level=0)
+    skeleton = ET.tostring(root, encoding='unicode')
+    obj_list.remove(obj_list[-1])
+    head, tail = skeleton.split('<' + _STREAM_PLACEHOLDER + ' />')
+
+    # obj_list is at level 2, its children at level 3
+    level = 3
+    separator = ('\n' + '\t'*level).encode('utf-8')
+
+    target = _output_target(fname)
+    f = target if hasattr(target,'write') else open(target,'wb')
+    records = profile.networks if profile is not None else None
+    recorded = len(records) if records is not None else 0
+    try:
+        out = _CountingWriter(f)
+        out.write(b"<?xml version='1.0' encoding='utf-8'?>\n")
+        out.write(head.encode('utf-8'))
+        for i,elem in enumerate(networks):
+            t0 = time.perf_counter()
+            start = out.bytes
+            if i > 0:
+                out.write(separator)
+            if isinstance(elem,str):
+                # Already serialized at this level by a network template
+                out.write(elem.encode('utf-8'))
+            else:
+                ET.indent(elem, space="\t", level=level)
+                out.write(ET.tostring(elem, encoding='utf-8', xml_declaration=False))
+                obj_list.remove(elem)
+            # Only if the generator recorded this network, not the one before
+            if records is not None and len(records) > recorded:
+                records[-1]['bytes'] = out.bytes - start
+                records[-1]['write_seconds'] = time.perf_counter() - t0
+                recorded = len(records)
+        out.write(tail.encode('utf-8'))
+    finally:
+        if f is not target:
+            f.close()
+    return out.bytes
+
+
+@dataclass
+class ExportJob:
+    """
+    One state machine to export with export_graph,
+    options are passed on as keyword arguments, e.g. {'language':'SCL'}
+    """
+    events:list
+    init_state:str
+    title:str
+    fname:str
+    fb_nr:int
+    options:dict = field(default_factory=dict)
+
+
+@dataclass
+class ExportResult:
+    """
+    Outcome of an ExportJob, error is None if the export succeeded
+    """
+    fname:str
+    fb_nr:int
+    seconds:float
+    error:str = None
+
+
+def export_graphs(jobs:list[ExportJob],max_workers=None)->list[ExportResult]:
+    """
+    Exports many state machines in parallel over a process pool
+    The FB numbers must be unique across the batch, including the
+    sub-FBs of split jobs (fb_nr + 1, ... unless sub_fb_nr is given).
+    Returns one ExportResult per job, in job order, a failing job does not stop the others.
+    max_workers=1 runs all jobs in the current process.
+    Split jobs cannot use cache_dir, they are rejected before any job runs
+    """
+    _check_split_jobs(jobs)
+    _check_unique_fb_numbers(jobs)
+
+    if max_workers == 1 or len(jobs) <= 1:
+        return [_run_export_job(j) for j in jobs]
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    workers = max_workers or os.cpu_count() or 1
+    chunksize = max(1, len(jobs) // (workers*4))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_run_export_job, jobs, chunksize=chunksize))
+
+
+def export_bundle(jobs:list[ExportJob],path,max_workers=None)->list[ExportResult]:
+    """
+    Exports many state machines like export_graphs, into a single .zip or
+    .tar.gz archive instead of one file each. Each FB is stored as the base
+    name of its fname + '.xml', next to a manifest.json with file, FB number,
+    title, size and sha256 of every FB in the archive. The instance DB of a
+    job with stations is stored as fname + '_DB.xml' and listed with its DB number.
+    Failed jobs are left out of the archive and reported in the results.
+    Split jobs write one file per FB and are rejected before any job runs
+    """
+    _check_split_jobs(jobs,bundle=True)
+    _check_unique_fb_numbers(jobs)
+    names = [os.path.basename(str(j.fname)) + '.xml' for j in jobs]
+    all_names = names + [n[:-4] + '_DB.xml' for j,n in zip(jobs,names) if j.options.get('stations') is not None]
+    if len(set(all_names)) != len(all_names):
+        raise ValueError('Duplicate file names in bundle: ' +
+                         ', '.join(sorted({n for n in all_names if all_names.count(n) > 1})))
+    if str(path).endswith('.zip'):
+        archive = _ZipBundle(path)
+    elif str(path).endswith(('.tar.gz','.tgz')):
+        archive = _TarBundle(path)
+    else:
+        raise ValueError('Unknown bundle format, use .zip or .tar.gz: ' + str(path))
+
+    if max_workers == 1 or len(jobs) <= 1:
+        outputs = map(_run_bundle_job, jobs)
+        pool = None
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        workers = max_workers or os.cpu_count() or 1
+        pool = ProcessPoolExecutor(max_workers=workers)
+        outputs = pool.map(_run_bundle_job, jobs, chunksize=max(1, len(jobs) // (workers*4)))
+
+    results = []
+    manifest = []
+    try:
+        with archive:
+            for job,name,(result,data,db) in zip(jobs,names,outputs):
+                results.append(result)
+                if data is None:
+                    continue
+                archive.add(name,data)
+                manifest.append({'file':name,'fb_nr':int(job.fb_nr),'title':job.title,
+                                 'bytes':len(data),'sha256':hashlib.sha256(data).hexdigest()})
+                if db is not None:
+                    db_name = name[:-4] + '_DB.xml'
+                    db_nr = job.options.get('station_db_nr')
+                    archive.add(db_name,db)
+                    manifest.append({'file':db_name,'db_nr':int(job.fb_nr if db_nr is None else db_nr),
+                                     'title':job.title,'bytes':len(db),'sha256':hashlib.sha256(db).hexdigest()})
+            archive.add('manifest.json',json.dumps(manifest,indent=1).encode('utf-8'))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return results
+
+
+class _ZipBundle:
+    def __init__(self,path):
+        import zipfile
+        self.archive = zipfile.ZipFile(path,'w',compression=zipfile.ZIP_DEFLATED)
+
+    def add(self,name,data):
+        self.archive.writestr(name,data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.archive.close()
+
+
+class _TarBundle:
+    def __init__(self,path):
+        import tarfile
+        self.tarfile = tarfile
+        self.archive = tarfile.open(path,'w:gz')
+
+    def add(self,name,data):
+        info = self.tarfile.TarInfo(name)
+        info.size = len(data)
+        self.archive.addfile(info,io.BytesIO(data))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.archive.close()
+
+
+def _run_bundle_job(job):
+    """
+    Runs a single ExportJob to bytes, returns the ExportResult, the XML or None
+    and the XML of the instance DB of a job with stations or None
+    """
+    t0 = time.perf_counter()
+    data = None
+    db = None
+    error = None
+    try:
+        options = dict(job.options)
+        if options.get('stations') is not None:
+            options['station_db'] = io.BytesIO()
+        data = export_graph(job.events,job.init_state,job.title,None,job.fb_nr,**options)
+        if 'station_db' in options:
+            db = options['station_db'].getvalue()
+    except Exception:
+        error = traceback.format_exc()
+    return ExportResult(str(job.fname),job.fb_nr,time.perf_counter() - t0,error), data, db
+
+
+def _check_unique_fb_numbers(jobs):
+    """
+    Raises ValueError if several jobs would generate the same FB number,
+    the sub-FBs of split jobs included
+    """
+    seen = {}
+    duplicates = []
+    for j in jobs:
+        for nr,fname in _job_fb_numbers(j):
+            if nr in seen:
+                duplicates.append('FB' + str(nr) + ' (' + str(seen[nr]) + ', ' + str(fname) + ')')
+            else:
+                seen[nr] = fname
+    if len(duplicates) > 0:
+        raise ValueError('Duplicate FB numbers: ' + ', '.join(duplicates))
+
+
+def _check_split_jobs(jobs,bundle=False):
+    """
+    Raises ValueError for split jobs that cannot be exported, a split export
+    writes one file per FB, which can neither be cached nor bundled
+    """
+    split = [str(j.fname) for j in jobs if j.options.get('split') is not None and
+             (bundle or j.options.get('cache_dir') is not None)]
+    if len(split) > 0:
+        raise ValueError('Split jobs cannot be ' + ('bundled' if bundle else 'cached, remove --cache or split') +
+                         ': ' + ', '.join(split))
+
+
+def _job_fb_numbers(job):
+    """
+    (FB number, file name) of each FB a job writes. A split job is grouped
+    here already to know how many sub-FBs it numbers from sub_fb_nr
+    """
+    numbers = [(int(job.fb_nr),job.fname)]
+    split = job.options.get('split')
+    if split is not None:
+        try:
+            graph = _as_graph(job.events,clean=True)
+            groups = _split_groups(graph,_clean_str(job.init_state),split)
+        except (ValueError,TypeError):
+            # The export fails with the same error and reports it as the result of the job
+            return numbers
+        if len(groups) > 1:
+            sub_fb_nr = job.options.get('sub_fb_nr')
+            first = int(job.fb_nr) + 1 if sub_fb_nr is None else int(sub_fb_nr)
+            numbers += [(first + k,str(job.fname) + '_' + str(k+1)) for k in range(len(groups))]
+    return numbers
+
+
+def _run_export_job(job):
+    """
+    Runs a single ExportJob, used as the process pool worker
+    """
+    t0 = time.perf_counter()
+    error = None
+    try:
+        export_graph(job.events,job.init_state,job.title,job.fname,job.fb_nr,**job.options)
+    except Exception:
+        error = traceback.format_exc()
+    return ExportResult(str(job.fname),job.fb_nr,time.perf_counter() - t0,error)
+
+
+def load_jobs(path)->list[ExportJob]:
+    """
+    Reads export jobs from a JSON file with a list of jobs like:
+        {"events": [["INIT","GOTO_HOME","init to home"], ...],
+         "init_state": "INIT", "title": "Demo", "fname": "demo_FB", "fb_nr": 45,
+         "options": {"language": "SCL"}}
+    events can also be the name of a CSV, JSON or YAML event file, see event_io.load_events.
+    Relative fnames are relative to the JSON file
+    """
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    return [_load_job(d,base,path,i) for i,d in enumerate(data)]
+
+
+def _load_job(d,base,path,i):
+    """
+    Creates the ExportJob of entry i of a job file
+    """
+    try:
+        if isinstance(d['events'],str):
+            from event_io import load_events
+            events = load_events(os.path.join(base,d['events']))
+        else:
+            events = [Event(*e) for e in d['events']]
+        return ExportJob(events,d['init_state'],d['title'],
+                         os.path.join(base,d['fname']),d['fb_nr'],d.get('options',{}))
+    except (KeyError,TypeError) as e:
+        raise ValueError('Invalid job ' + str(i) + ' in ' + str(path) + ': ' + str(e))
+
+
+def watch_jobs(path,interval=0.05,render=None,cache_dir=None,stop=None,log=print):
+    """
+    Keeps exporting the jobs of a job file, see load_jobs, whenever they change.
+    The job file and the event files it refers to are polled every interval
+    seconds, and only jobs whose entry or event file changed are exported again,
+    in this process so nothing has to be imported or started per export.
+    render is a graphviz format, e.g. 'svg', to also render changed jobs.
+    Runs until stop() returns True or the process is interrupted
+    """
+    base = os.path.dirname(os.path.abspath(path))
+    done = {}      # job index -> signature of the last export
+    job_file = None
+    data = []
+    try:
+        while stop is None or not stop():
+            sig = _file_signature(path)
+            if sig != job_file:
+                try:
+                    with open(path, encoding='utf-8') as f:
+                        data = json.load(f)
+                    job_file = sig
+                    _check_watch_jobs(data,base,path,cache_dir)
+                except (OSError,ValueError,TypeError,AttributeError) as e:
+                    # Probably saved half way, try again next time
+                    log('ERROR\t' + str(path) + ': ' + str(e))
+                    job_file = sig
+                    data = []
+
+            for i,d in enumerate(data):
+                events = d.get('events') if isinstance(d,dict) else None
+                files = [os.path.join(base,events)] if isinstance(events,str) else []
+                sig = (json.dumps(d,sort_keys=True),[_file_signature(f) for f in files])
+                if done.get(i) == sig:
+                    continue
+                done[i] = sig
+                log(_watch_export(d,base,path,i,render,cache_dir))
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+
+def _check_watch_jobs(data,base,path,cache_dir):
+    """
+    Checks the entries of a job file like export_graphs before any is exported,
+    an entry whose events cannot be loaded yet is checked without them
+    """
+    jobs = []
+    for i,d in enumerate(data):
+        try:
+            job = _load_job(d,base,path,i)
+        except (OSError,ValueError):
+            job = ExportJob([],'','',d.get('fname'),d.get('fb_nr'))
+        if cache_dir is not None:
+            job.options = dict({'cache_dir':cache_dir},**job.options)
+        jobs.append(job)
+    _check_split_jobs(jobs)
+    _check_unique_fb_numbers(jobs)
+
+
+def _file_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns,st.st_size)
+
+
+def _watch_export(d,base,path,i,render,cache_dir):
+    """
+    Exports and optionally renders entry i of a job file, returns a log line
+    """
+    t0 = time.perf_counter()
+    try:
+        job = _load_job(d,base,path,i)
+        options = dict(job.options)
+        if cache_dir is not None:
+            options.setdefault('cache_dir',cache_dir)
+        export_graph(job.events,job.init_state,job.title,job.fname,job.fb_nr,**options)
+        if render is not None:
+            render_graph(job.events,job.init_state,job.fname,view=False,format=render)
+    except Exception as e:
+        return 'ERROR\t' + str(d.get('fname') if isinstance(d,dict) else i) + ': ' + str(e)
+    return 'FB' + str(job.fb_nr) + '\t' + '%.1fms' % (1000*(time.perf_counter() - t0)) + '\t' + job.fname
 
 
 def _int2hex(s):
@@ -129,12 +1270,7 @@ def get_states(events):
     """
     Returns all states in a state machine
     """
-    state_names = set()
-    for f in events:
-        state_names.add(f.src)
-        state_names.add(f.dest)
-
-    return state_names
+    return set(_as_graph(events).states)
 
 
 def get_states_sortedo(events,init_state):
@@ -172,60 +1308,91 @@ def get_states_sorted(events,init_state):
     """
     Sorts states in a state machine, starting from the initial state
     """
+    return _as_graph(events).sorted_states(init_state)
 
-    states = []
-    _dive_states(events,init_state,states)
 
-    return states
-
-
-
-def _dive_states(events, current_state, history):
-    """
-    Recursive function to sort states in a state machine
-    """
-    history.append(current_state)
-    out_evs = get_outgoing_events(events,current_state)
-    for e in out_evs:
-        if e.dest not in history:
-            _dive_states(events,e.dest,history)
 
 
 
+# Characters replaced or removed by _clean_str
+_CLEAN_TABLE = str.maketrans({' ':'_','-':'_','/':'_','\\':'_','.':None,',':None})
 
+# Longest identifier TIA accepts for variables and constants
+MAX_NAME_LENGTH = 128
 
+@functools.lru_cache(maxsize=65536)
 def _clean_str(s):
     """
     Cleans state/transitions names for valid TIA variable names
     """
-    try:
-        a = int(s[0])
-        s = '_' + s 
-    except:
-        pass
-
-    s = s.replace(' ','_')
-    s = s.replace('-','_')
-    s = s.replace('/','_')
-    s = s.replace('\\','_')
-    s = s.replace('.','')
-    s = s.replace(',','')
-    return s.upper()
+    if s[:1].isdecimal():
+        s = '_' + s
+    return s.translate(_CLEAN_TABLE).upper()
 
 def clean_names(events):
     """
     Cleans names in events for valid TIA variable names
+    The events are modified, see cleaned_events for a copy
     """
     for e in events:
         #e.trigger = clean_str(e.trigger)
-        e.src = _clean_str(e.src).upper()
-        e.dest = _clean_str(e.dest).upper()
+        e.src = _clean_str(e.src)
+        e.dest = _clean_str(e.dest)
     return events
 
+
+class NameCleaner:
+    """
+    Cleans names like _clean_str, remembering every name it has cleaned,
+    so distinct names that end up as the same TIA identifier and names
+    longer than MAX_NAME_LENGTH can be reported
+    """
+    def __init__(self):
+        self.names = {}       # original name -> cleaned name
+        self.collisions = {}  # cleaned name -> distinct original names
+        self.too_long = []    # cleaned names longer than MAX_NAME_LENGTH
+        self._originals = {}
+
+    def __call__(self,name):
+        c = self.names.get(name)
+        if c is not None:
+            return c
+        c = self.names[name] = sys.intern(_clean_str(name))
+        first = self._originals.setdefault(c,name)
+        if first != name:
+            self.collisions.setdefault(c,[first]).append(name)
+        elif len(c) > MAX_NAME_LENGTH:
+            self.too_long.append(c)
+        return c
+
+    def check(self):
+        """
+        Raises ValueError if any names collide or are too long for TIA
+        """
+        problems = []
+        for c,originals in self.collisions.items():
+            problems.append(', '.join(repr(o) for o in originals) + ' -> ' + c)
+        for c in self.too_long:
+            problems.append(c + ' is longer than ' + str(MAX_NAME_LENGTH) + ' characters')
+        if len(problems) > 0:
+            raise ValueError('Invalid state names: ' + '; '.join(problems))
+
+
+def cleaned_events(events,cleaner=None)->list[FrozenEvent]:
+    """
+    Returns the events with names cleaned for valid TIA variable names as
+    FrozenEvent, without modifying the events. Each distinct name is cleaned once,
+    cleaner is a NameCleaner that collects collisions over several calls
+    """
+    c = cleaner if cleaner is not None else NameCleaner()
+    return [FrozenEvent(c(e.src),c(e.dest),e.trigger,e.priority) for e in events]
+
 def get_outgoing_events(events:list[Event],current_state)->list[Event]:
     """
     Finds all outgoing events from a state
     """
+    if isinstance(events,TransitionGraph):
+        return list(events.outgoing_events(current_state))
 
     out_evs = []
 
@@ -302,6 +1469,22 @@ def _add_access_element_scl(root,type,uid,name=''):
         const.attrib['Name'] = name
         const.attrib['UId'] = str(uid.tic())
 
+    elif type == 'false':
+        access.attrib['Scope'] = 'LiteralConstant'
+        const = ET.SubElement(access, "Constant")
+        const.attrib['UId'] = str(uid.tic())
+        const_val = ET.SubElement(const, "ConstantValue")
+        const_val.attrib['UId'] = str(uid.tic())
+        const_val.text = 'FALSE'
+
+    elif type == 'literal':
+        access.attrib['Scope'] = 'LiteralConstant'
+        const = ET.SubElement(access, "Constant")
+        const.attrib['UId'] = str(uid.tic())
+        const_val = ET.SubElement(const, "ConstantValue")
+        const_val.attrib['UId'] = str(uid.tic())
+        const_val.text = str(name)
+
     else:
         raise ValueError('Unknown type')
     return access, uid
@@ -352,7 +1535,7 @@ def _scl_token(root, txt, uid):
     tok.attrib['Text'] = txt
     return tok
 
-def _write_reset_net(root,net_id, init_state_name):
+def _write_reset_net(root,net_id, init_state_name,cultures=CULTURES):
     """
     Writes the reset network in SCL
     """
@@ -398,10 +1581,10 @@ def _write_reset_net(root,net_id, init_state_name):
     ET.SubElement(attr_list,'ProgrammingLanguage').text = 'SCL'
 
     obj_list = ET.SubElement(sw, "ObjectList")
-    _create_multilingual_text(obj_list,net_id,'Title','Reset')
+    _create_multilingual_text(obj_list,net_id,'Title','Reset',cultures)
 
 
-def _write_next_step_net(root,net_id):
+def _write_next_step_net(root,net_id,cultures=CULTURES):
     """
     Writes the 'next step' network in SCL
     """
@@ -438,13 +1621,656 @@ def _write_next_step_net(root,net_id):
     ET.SubElement(attr_list,'ProgrammingLanguage').text = 'SCL'
 
     obj_list = ET.SubElement(sw, "ObjectList")
-    _create_multilingual_text(obj_list,net_id,'Title','Next step')
-    _create_multilingual_text(obj_list,net_id,'Comment','This ensurers that we remain in each state step at least 1 plc cycle')
+    _create_multilingual_text(obj_list,net_id,'Title','Next step',cultures)
+    _create_multilingual_text(obj_list,net_id,'Comment','This ensurers that we remain in each state step at least 1 plc cycle',cultures)
+
+
+
+
+def _scl_blank(root,uid,num=1):
+    """
+    Adds blank space to SCL code, num is the number of spaces
+    """
+    blank = ET.SubElement(root,"Blank")
+    if num > 1:
+        blank.attrib['Num'] = str(num)
+    blank.attrib['UId'] = str(uid.tic())
+    return blank
+
+def _scl_newline(root,uid):
+    """
+    Adds a line break to SCL code
+    """
+    nl = ET.SubElement(root,"NewLine")
+    nl.attrib['UId'] = str(uid.tic())
+    return nl
+
+def _write_case_network(root,net_id,steps,cultures=CULTURES):
+    """
+    Writes all steps as a single SCL network with a CASE statement,
+    only the branch of the active step is evaluated each PLC cycle.
+    steps is a list of (src_step, dest_steps), dest_steps in network order.
+    The transitions of a step are an IF/ELSIF chain in reverse network order,
+    so evaluation stops at the first one that fires, which is the one that
+    would have won in LAD
+    """
+
+    uid = UidCounter(21)
+    sw = ET.SubElement(root, "SW.Blocks.CompileUnit")
+    sw.attrib['CompositionName'] = 'CompileUnits'
+    sw.attrib['ID'] = _int2hex(net_id.tic())
+    attr_list = ET.SubElement(sw, "AttributeList")
+    net_src = ET.SubElement(attr_list, "NetworkSource")
+    st_text = ET.SubElement(net_src,"StructuredText")
+    st_text.attrib['xmlns'] = 'http://www.siemens.com/automation/Openness/SW/NetworkSource/StructuredText/v3'
+
+    _scl_token(st_text,'CASE',str(uid.tic()))
+    _scl_blank(st_text,uid)
+    _add_access_element_scl(st_text,'stat',uid,'statStep')
+    _scl_blank(st_text,uid)
+    _scl_token(st_text,'OF',str(uid.tic()))
+    _scl_newline(st_text,uid)
+
+    for src_step,dest_steps in steps:
+        _scl_blank(st_text,uid,4)
+        _add_access_element_scl(st_text,'constant',uid,src_step)
+        _scl_token(st_text,':',str(uid.tic()))
+        _scl_newline(st_text,uid)
+
+        for i,d in enumerate(reversed(dest_steps)):
+            # IF FALSE THEN statNextStep := d; ELSIF ... END_IF;
+            _scl_blank(st_text,uid,8)
+            _scl_token(st_text,'IF' if i == 0 else 'ELSIF',str(uid.tic()))
+            _scl_blank(st_text,uid)
+            _add_access_element_scl(st_text,'false',uid)
+            _scl_blank(st_text,uid)
+            _scl_token(st_text,'THEN',str(uid.tic()))
+            _scl_newline(st_text,uid)
+
+            _scl_blank(st_text,uid,12)
+            _add_access_element_scl(st_text,'stat',uid,'statNextStep')
+            _scl_blank(st_text,uid)
+            _scl_token(st_text,':=',str(uid.tic()))
+            _scl_blank(st_text,uid)
+            _add_access_element_scl(st_text,'constant',uid,d)
+            _scl_token(st_text,';',str(uid.tic()))
+            _scl_newline(st_text,uid)
+
+        _scl_blank(st_text,uid,8)
+        _scl_token(st_text,'END_IF',str(uid.tic()))
+        _scl_token(st_text,';',str(uid.tic()))
+        _scl_newline(st_text,uid)
+
+    _scl_token(st_text,'END_CASE',str(uid.tic()))
+    _scl_token(st_text,';',str(uid.tic()))
+
+    ET.SubElement(attr_list,'ProgrammingLanguage').text = 'SCL'
+
+    obj_list = ET.SubElement(sw, "ObjectList")
+
+    comment_str = ''
+    for src_step,dest_steps in steps:
+        comment_str += src_step + '\n'
+        for d in reversed(dest_steps):
+            comment_str += '\t -> ' + str(d) + ' \n'
+
+    _create_multilingual_text(obj_list,net_id,'Comment',comment_str,cultures)
+    _create_multilingual_text(obj_list,net_id,'Title','Steps',cultures)
+
+    return sw
+
+
+def _write_dispatch_network(root,net_id,instances,ranges,cultures=CULTURES):
+    """
+    Writes the network of a split FB that calls the sub-FB of the active step:
+        CASE statStep OF
+            0..40:
+                statSub1(statStep := statStep, statNextStep := statNextStep);
+            ...
+        END_CASE;
+    instances are the (multi-instance name, FB name), ranges the (first, last) step of each
+    """
+
+    uid = UidCounter(21)
+    sw = ET.SubElement(root, "SW.Blocks.CompileUnit")
+    sw.attrib['CompositionName'] = 'CompileUnits'
+    sw.attrib['ID'] = _int2hex(net_id.tic())
+    attr_list = ET.SubElement(sw, "AttributeList")
+    net_src = ET.SubElement(attr_list, "NetworkSource")
+    st_text = ET.SubElement(net_src,"StructuredText")
+    st_text.attrib['xmlns'] = 'http://www.siemens.com/automation/Openness/SW/NetworkSource/StructuredText/v3'
+
+    _scl_token(st_text,'CASE',str(uid.tic()))
+    _scl_blank(st_text,uid)
+    _add_access_element_scl(st_text,'stat',uid,'statStep')
+    _scl_blank(st_text,uid)
+    _scl_token(st_text,'OF',str(uid.tic()))
+    _scl_newline(st_text,uid)
+
+    for (inst,fb_name),(first,last) in zip(instances,ranges):
+        _scl_blank(st_text,uid,4)
+        _add_access_element_scl(st_text,'literal',uid,first)
+        if last != first:
+            _scl_token(st_text,'..',str(uid.tic()))
+            _add_access_element_scl(st_text,'literal',uid,last)
+        _scl_token(st_text,':',str(uid.tic()))
+        _scl_newline(st_text,uid)
+
+        _scl_blank(st_text,uid,8)
+        call = ET.SubElement(st_text,"Access")
+        call.attrib['Scope'] = 'Call'
+        call.attrib['UId'] = str(uid.tic())
+        info = ET.SubElement(call,"CallInfo")
+        info.attrib['Name'] = fb_name
+        info.attrib['BlockType'] = 'FB'
+        info.attrib['UId'] = str(uid.tic())
+        instance = ET.SubElement(info,"Instance")
+        instance.attrib['Scope'] = 'LocalVariable'
+        instance.attrib['UId'] = str(uid.tic())
+        comp = ET.SubElement(instance,"Component")
+        comp.attrib['Name'] = inst
+        comp.attrib['UId'] = str(uid.tic())
+        _scl_token(info,'(',str(uid.tic()))
+        for i,param in enumerate(['statStep','statNextStep']):
+            if i > 0:
+                _scl_token(info,',',str(uid.tic()))
+                _scl_blank(info,uid)
+            p = ET.SubElement(info,"Parameter")
+            p.attrib['Name'] = param
+            p.attrib['Section'] = 'InOut'
+            p.attrib['Type'] = 'Int'
+            p.attrib['UId'] = str(uid.tic())
+            _scl_blank(p,uid)
+            _scl_token(p,':=',str(uid.tic()))
+            _scl_blank(p,uid)
+            _add_access_element_scl(p,'stat',uid,param)
+        _scl_token(info,')',str(uid.tic()))
+        _scl_token(st_text,';',str(uid.tic()))
+        _scl_newline(st_text,uid)
+
+    _scl_token(st_text,'END_CASE',str(uid.tic()))
+    _scl_token(st_text,';',str(uid.tic()))
+
+    ET.SubElement(attr_list,'ProgrammingLanguage').text = 'SCL'
+
+    obj_list = ET.SubElement(sw, "ObjectList")
+    _create_multilingual_text(obj_list,net_id,'Title','Sub state machines',cultures)
+
+    return sw
+
+
+# Static members of the instrumentation network, arrays are indexed by step value / 10
+_INSTRUMENTATION = [('statEntryCount','DInt','Number of times each state has been entered'),
+                    ('statDwellTime','LReal','Accumulated time in each state [s]'),
+                    ('statLastTransition','Int','Step each state was last entered from')]
+
+def _create_instrumentation_members(stat_section,temp_section,n_states,cultures=CULTURES):
+    """
+    Adds the Static and Temp members used by the instrumentation network
+    """
+    for name,datatype,comment in _INSTRUMENTATION:
+        m = _create_member(stat_section,name,'Array[0..' + str(max(n_states,1)-1) + '] of ' + datatype)
+        _create_multilanguageComment_blk_io(m,comment,cultures)
+
+    m = _create_member(stat_section,'statRuntime','LReal')
+    _create_multilanguageComment_blk_io(m,'Memory of RUNTIME',cultures)
+
+    m = _create_member(stat_section,'statRuntimeValid','Bool')
+    _create_multilanguageComment_blk_io(m,'RUNTIME has been called before, its result is a cycle time',cultures)
+
+    _create_member(temp_section,'tempCycleTime','LReal')
+    _create_member(temp_section,'tempStepIdx','Int')
+    _create_member(temp_section,'tempNextIdx','Int')
+
 
+def _add_array_access_scl(root,uid,name,index):
+    """
+    Adds a reference to name[index] in SCL code, index is a local variable
+    """
+    access = ET.SubElement(root,"Access")
+    access.attrib['Scope'] = 'LocalVariable'
+    access.attrib['UId'] = str(uid.tic())
+
+    symb = ET.SubElement(access, "Symbol")
+    symb.attrib['UId'] = str(uid.tic())
+
+    comp = ET.SubElement(symb, "Component")
+    comp.attrib['Name'] = name
+    comp.attrib['AccessModifier'] = 'Array'
+    comp.attrib['UId'] = str(uid.tic())
+    _scl_token(comp,'[',str(uid.tic()))
+    _add_access_element_scl(comp,'stat',uid,index)
+    _scl_token(comp,']',str(uid.tic()))
+    return access
+
+
+def _scl_assign(st_text,uid,indent,target,value):
+    """
+    Writes 'target := value;' where target and value are _SclExpr expressions
+    """
+    if indent > 0:
+        _scl_blank(st_text,uid,indent)
+    target(st_text)
+    _scl_blank(st_text,uid)
+    _scl_token(st_text,':=',str(uid.tic()))
+    _scl_blank(st_text,uid)
+    value(st_text)
+    _scl_token(st_text,';',str(uid.tic()))
+    _scl_newline(st_text,uid)
 
 
+class _SclExpr:
+    """
+    Builds SCL expressions, each is a function that adds its access
+    elements and tokens to the element it is called with
+    """
+    def __init__(self,uid):
+        self.uid = uid
+
+    def stat(self,name):
+        return lambda parent: _add_access_element_scl(parent,'stat',self.uid,name)
+
+    def array(self,name,index):
+        return lambda parent: _add_array_access_scl(parent,self.uid,name,index)
+
+    def literal(self,value):
+        return lambda parent: _add_access_element_scl(parent,'literal',self.uid,value)
+
+    def constant(self,name):
+        return lambda parent: _add_access_element_scl(parent,'constant',self.uid,name)
+
+    def false(self):
+        return lambda parent: _add_access_element_scl(parent,'false',self.uid)
+
+    def binary(self,left,op,right):
+        uid = self.uid
+        def write(parent):
+            left(parent)
+            _scl_blank(parent,uid)
+            _scl_token(parent,op,str(uid.tic()))
+            _scl_blank(parent,uid)
+            right(parent)
+        return write
+
+    def call(self,instruction,params):
+        """
+        Call of an instruction, params are (name, expression)
+        """
+        uid = self.uid
+        def write(parent):
+            call = ET.SubElement(parent,"Access")
+            call.attrib['Scope'] = 'Call'
+            call.attrib['UId'] = str(uid.tic())
+            instr = ET.SubElement(call,"Instruction")
+            instr.attrib['Name'] = instruction
+            instr.attrib['UId'] = str(uid.tic())
+            _scl_token(instr,'(',str(uid.tic()))
+            for i,(name,value) in enumerate(params):
+                if i > 0:
+                    _scl_token(instr,',',str(uid.tic()))
+                    _scl_blank(instr,uid)
+                param = ET.SubElement(instr,"Parameter")
+                param.attrib['Name'] = name
+                param.attrib['UId'] = str(uid.tic())
+                _scl_token(param,':=',str(uid.tic()))
+                value(param)
+            _scl_token(instr,')',str(uid.tic()))
+        return write
+
+
+def _scl_if(st_text,uid,cond,keyword='IF'):
+    """
+    Writes 'IF cond THEN' and a new line, keyword='ELSIF' for the next branch
+    """
+    _scl_token(st_text,keyword,str(uid.tic()))
+    _scl_blank(st_text,uid)
+    cond(st_text)
+    _scl_blank(st_text,uid)
+    _scl_token(st_text,'THEN',str(uid.tic()))
+    _scl_newline(st_text,uid)
+
 
-def _write_step_network(root,src_step, dest_steps,uid_counter):
+def _scl_network(root,net_id,title,comment,cultures=CULTURES):
+    """
+    Adds an empty SCL network, returns it and its StructuredText
+    """
+    sw = ET.SubElement(root, "SW.Blocks.CompileUnit")
+    sw.attrib['CompositionName'] = 'CompileUnits'
+    sw.attrib['ID'] = _int2hex(net_id.tic())
+    attr_list = ET.SubElement(sw, "AttributeList")
+    net_src = ET.SubElement(attr_list, "NetworkSource")
+    st_text = ET.SubElement(net_src,"StructuredText")
+    st_text.attrib['xmlns'] = 'http://www.siemens.com/automation/Openness/SW/NetworkSource/StructuredText/v3'
+    ET.SubElement(attr_list,'ProgrammingLanguage').text = 'SCL'
+
+    obj_list = ET.SubElement(sw, "ObjectList")
+    _create_multilingual_text(obj_list,net_id,'Title',title,cultures)
+    _create_multilingual_text(obj_list,net_id,'Comment',comment,cultures)
+    return sw,st_text
+
+
+def _write_instrumentation_net(root,net_id,cultures=CULTURES):
+    """
+    Writes the instrumentation network in SCL, placed before the 'next step' network:
+        #tempCycleTime := RUNTIME(#statRuntime);
+        #tempStepIdx := #statStep / 10;
+        IF #statRuntimeValid THEN
+            #statDwellTime[#tempStepIdx] := #statDwellTime[#tempStepIdx] + #tempCycleTime;
+        END_IF;
+        #statRuntimeValid := TRUE;
+        IF #enable AND #statNextStep <> #statStep THEN
+            #tempNextIdx := #statNextStep / 10;
+            #statEntryCount[#tempNextIdx] := #statEntryCount[#tempNextIdx] + 1;
+            #statLastTransition[#tempNextIdx] := #statStep;
+        END_IF;
+    RUNTIME is called once per cycle, no timers per state are needed. The
+    first call returns the time since the CPU started, not a cycle time, and
+    is not added to the dwell time
+    """
+    sw,st_text = _scl_network(root,net_id,'Instrumentation',
+                              'Entry counters, dwell time and last transition per state, indexed by step / 10',cultures)
+    uid = UidCounter(21)
+    x = _SclExpr(uid)
+
+    _scl_assign(st_text,uid,0,x.stat('tempCycleTime'),x.call('RUNTIME',[('MEM',x.stat('statRuntime'))]))
+    _scl_assign(st_text,uid,0,x.stat('tempStepIdx'),x.binary(x.stat('statStep'),'/',x.literal(10)))
+    _scl_if(st_text,uid,x.stat('statRuntimeValid'))
+    _scl_assign(st_text,uid,4,x.array('statDwellTime','tempStepIdx'),
+                x.binary(x.array('statDwellTime','tempStepIdx'),'+',x.stat('tempCycleTime')))
+    _scl_token(st_text,'END_IF',str(uid.tic()))
+    _scl_token(st_text,';',str(uid.tic()))
+    _scl_newline(st_text,uid)
+    _scl_assign(st_text,uid,0,x.stat('statRuntimeValid'),x.literal('TRUE'))
+
+    _scl_if(st_text,uid,x.binary(x.stat('enable'),'AND',x.binary(x.stat('statNextStep'),'<>',x.stat('statStep'))))
+    _scl_assign(st_text,uid,4,x.stat('tempNextIdx'),x.binary(x.stat('statNextStep'),'/',x.literal(10)))
+    _scl_assign(st_text,uid,4,x.array('statEntryCount','tempNextIdx'),
+                x.binary(x.array('statEntryCount','tempNextIdx'),'+',x.literal(1)))
+    _scl_assign(st_text,uid,4,x.array('statLastTransition','tempNextIdx'),x.stat('statStep'))
+    _scl_token(st_text,'END_IF',str(uid.tic()))
+    _scl_token(st_text,';',str(uid.tic()))
+    return sw
+
+
+# Bits per word of stateFlags and the literal of bit 0
+_STATE_FLAG_WORDS = {'Word':(16,'W#16#1'),'DWord':(32,'DW#16#1')}
+
+def _state_flags_type(state_flags):
+    """
+    Word type of the state_flags argument of export_graph, None without flags
+    """
+    if state_flags is None or state_flags is False:
+        return None
+    if state_flags is True:
+        return 'DWord'
+    if state_flags not in _STATE_FLAG_WORDS:
+        raise ValueError('Unknown state_flags: ' + str(state_flags) + ", use True, 'Word' or 'DWord'")
+    return state_flags
+
+
+def _create_state_flags_members(out_section,stat_section,temp_section,n_states,word_type,cultures=CULTURES):
+    """
+    Adds the outputs of the state flags network and the members it works on
+    """
+    bits = _STATE_FLAG_WORDS[word_type][0]
+    words = max((n_states + bits - 1) // bits,1)
+    m = _create_member(out_section,'stateFlags','Array[0..' + str(words-1) + '] of ' + word_type)
+    _create_multilanguageComment_blk_io(m,'Bit step / 10 is set for the active state',cultures)
+
+    m = _create_member(out_section,'transitionCount','UDInt')
+    _create_multilanguageComment_blk_io(m,'Incremented each time stateFlags changes',cultures)
+
+    # -1 is no state, the flags of init_state are set in the first cycle
+    m = _create_member(stat_section,'statFlagStep','Int',-1)
+    _create_multilanguageComment_blk_io(m,'Step the state flags were set for',cultures)
+
+    _create_member(temp_section,'tempFlagWord','Int')
+
+
+def _write_state_flags_net(root,net_id,word_type,cultures=CULTURES):
+    """
+    Writes the state flags network in SCL, placed after the 'next step' network
+    so the flags show the step of the next cycle. For DWord flags:
+        IF #statFlagStep <> #statStep THEN
+            #tempFlagWord := #statFlagStep / 320;
+            #stateFlags[#tempFlagWord] := 0;
+            #tempFlagWord := #statStep / 320;
+            #stateFlags[#tempFlagWord] := SHL(IN := DW#16#1, N := #statStep / 10 MOD 32);
+            #statFlagStep := #statStep;
+            #transitionCount := #transitionCount + 1;
+        END_IF;
+    Only the word of the last state is cleared, one bit is set at a time.
+    Nothing is written while the step does not change
+    """
+    bits,one = _STATE_FLAG_WORDS[word_type]
+    sw,st_text = _scl_network(root,net_id,'State flags',
+                              'Bit-packed active state and transition counter for HMI/SCADA',cultures)
+    uid = UidCounter(21)
+    x = _SclExpr(uid)
+
+    _scl_if(st_text,uid,x.binary(x.stat('statFlagStep'),'<>',x.stat('statStep')))
+    _scl_assign(st_text,uid,4,x.stat('tempFlagWord'),x.binary(x.stat('statFlagStep'),'/',x.literal(bits*10)))
+    _scl_assign(st_text,uid,4,x.array('stateFlags','tempFlagWord'),x.literal(0))
+    _scl_assign(st_text,uid,4,x.stat('tempFlagWord'),x.binary(x.stat('statStep'),'/',x.literal(bits*10)))
+    bit = x.binary(x.binary(x.stat('statStep'),'/',x.literal(10)),'MOD',x.literal(bits))
+    _scl_assign(st_text,uid,4,x.array('stateFlags','tempFlagWord'),x.call('SHL',[('IN',x.literal(one)),('N',bit)]))
+    _scl_assign(st_text,uid,4,x.stat('statFlagStep'),x.stat('statStep'))
+    _scl_assign(st_text,uid,4,x.stat('transitionCount'),x.binary(x.stat('transitionCount'),'+',x.literal(1)))
+    _scl_token(st_text,'END_IF',str(uid.tic()))
+    _scl_token(st_text,';',str(uid.tic()))
+    return sw
+
+
+def _write_station_network(root,net_id,steps,init_state,stations,cultures=CULTURES):
+    """
+    Writes the single network of a stations FB, the reset, steps and next
+    step networks of each station in a loop:
+        FOR #tempStation := 0 TO 23 DO
+            IF #reset[#tempStation] THEN
+                #statStep[#tempStation] := INIT;
+                #statNextStep[#tempStation] := INIT;
+            END_IF;
+            CASE #statStep[#tempStation] OF
+                INIT:
+                    IF FALSE THEN
+                        #statNextStep[#tempStation] := GOTO_HOME;
+                    END_IF;
+                ...
+            END_CASE;
+            IF #enable[#tempStation] THEN
+                #statStep[#tempStation] := #statNextStep[#tempStation];
+            END_IF;
+        END_FOR;
+    steps is a list of (src_step, dest_steps) like for _write_case_network
+    """
+    sw,st_text = _scl_network(root,net_id,'Stations',
+                              'Reset, steps and next step of stations 0..' + str(stations-1),cultures)
+    uid = UidCounter(21)
+    x = _SclExpr(uid)
+    station = lambda name: x.array(name,'tempStation')
+    end_if = lambda indent: (_scl_blank(st_text,uid,indent),_scl_token(st_text,'END_IF',str(uid.tic())),
+                             _scl_token(st_text,';',str(uid.tic())),_scl_newline(st_text,uid))
+
+    _scl_token(st_text,'FOR',str(uid.tic()))
+    _scl_blank(st_text,uid)
+    x.binary(x.stat('tempStation'),':=',x.literal(0))(st_text)
+    _scl_blank(st_text,uid)
+    _scl_token(st_text,'TO',str(uid.tic()))
+    _scl_blank(st_text,uid)
+    x.literal(stations-1)(st_text)
+    _scl_blank(st_text,uid)
+    _scl_token(st_text,'DO',str(uid.tic()))
+    _scl_newline(st_text,uid)
+
+    _scl_blank(st_text,uid,4)
+    _scl_if(st_text,uid,station('reset'))
+    _scl_assign(st_text,uid,8,station('statStep'),x.constant(init_state))
+    _scl_assign(st_text,uid,8,station('statNextStep'),x.constant(init_state))
+    end_if(4)
+
+    _scl_blank(st_text,uid,4)
+    _scl_token(st_text,'CASE',str(uid.tic()))
+    _scl_blank(st_text,uid)
+    station('statStep')(st_text)
+    _scl_blank(st_text,uid)
+    _scl_token(st_text,'OF',str(uid.tic()))
+    _scl_newline(st_text,uid)
+    for src_step,dest_steps in steps:
+        _scl_blank(st_text,uid,8)
+        x.constant(src_step)(st_text)
+        _scl_token(st_text,':',str(uid.tic()))
+        _scl_newline(st_text,uid)
+        # Reverse network order, the first transition that fires wins
+        for i,d in enumerate(reversed(dest_steps)):
+            _scl_blank(st_text,uid,12)
+            _scl_if(st_text,uid,x.false(),'IF' if i == 0 else 'ELSIF')
+            _scl_assign(st_text,uid,16,station('statNextStep'),x.constant(d))
+        end_if(12)
+    _scl_blank(st_text,uid,4)
+    _scl_token(st_text,'END_CASE',str(uid.tic()))
+    _scl_token(st_text,';',str(uid.tic()))
+    _scl_newline(st_text,uid)
+
+    _scl_blank(st_text,uid,4)
+    _scl_if(st_text,uid,station('enable'))
+    _scl_assign(st_text,uid,8,station('statStep'),station('statNextStep'))
+    end_if(4)
+
+    _scl_token(st_text,'END_FOR',str(uid.tic()))
+    _scl_token(st_text,';',str(uid.tic()))
+    return sw
+
+
+def _write_station_db(title,fname,db_nr,stations,cultures=CULTURES,deterministic=False):
+    """
+    Writes the instance DB of a stations FB, with the interface of the FB
+    without Temp and Constant
+    """
+    root,obj_list,uid = _create_document([],title,db_nr,cultures,deterministic,stations=stations)
+    block = root.find('SW.Blocks.FB')
+    block.tag = 'SW.Blocks.InstanceDB'
+    attr_list = block.find('AttributeList')
+    interf = attr_list.find('Interface')
+    sections = interf[0]
+    for section in list(sections):
+        if section.attrib['Name'] in ('Temp','Constant'):
+            sections.remove(section)
+
+    attr_list.clear()
+    attr_list.append(interf)
+    ET.SubElement(attr_list, "InstanceOfName").text = _clean_str(title)
+    ET.SubElement(attr_list, "InstanceOfType").text = 'FB'
+    ET.SubElement(attr_list, "MemoryLayout").text = 'Optimized'
+    ET.SubElement(attr_list, "Name").text = _clean_str(title) + '_DB'
+    ET.SubElement(attr_list, "Number").text = str(db_nr)
+    ET.SubElement(attr_list, "ProgrammingLanguage").text = 'DB'
+
+    _create_multilingual_text(obj_list,uid,'Title',title + ' stations 0..' + str(stations-1),cultures)
+    _write_document(root,obj_list,uid,iter(()),fname)
+
+
+# Marks placeholders in network templates
+_MARK = '\x01'
+
+class _NetworkTemplate:
+    """
+    A network generated once with placeholder names and IDs.
+    Instances are made by substituting the names and IDs, either into a copy
+    of the element tree or directly into the serialized XML.
+    The local UIds inside a network are the same in all instances.
+    """
+    def __init__(self,elem,n_ids,level=3):
+        self.elem = elem
+        self.n_ids = n_ids
+
+        # Slots in the tree: (position in elem.iter(), attribute or None for text, parts)
+        self.slots = []
+        for pos,el in enumerate(elem.iter()):
+            for k,v in el.attrib.items():
+                if _MARK in v:
+                    self.slots.append((pos,k,self._parse(v)))
+            if el.text and _MARK in el.text:
+                self.slots.append((pos,None,self._parse(el.text)))
+
+        # The same network serialized, as the streaming writer would write it
+        txt = copy.deepcopy(elem)
+        ET.indent(txt, space="\t", level=level)
+        self.pieces = self._parse(ET.tostring(txt, encoding='unicode'))
+        # A placeholder inside a tag is an attribute value, otherwise it is text.
+        # Values are escaped the same way ElementTree escapes them.
+        self.escapes = [None]*len(self.pieces)
+        in_tag = False
+        for i in range(1,len(self.pieces),2):
+            prev = self.pieces[i-1]
+            if '<' in prev or '>' in prev:
+                in_tag = prev.rfind('<') > prev.rfind('>')
+            self.escapes[i] = ET._escape_attrib if in_tag else ET._escape_cdata
+
+    @staticmethod
+    def _parse(txt):
+        """
+        Splits a string into literal text and placeholders,
+        placeholders are (is_name, index) at odd positions
+        """
+        parts = txt.split(_MARK)
+        for i in range(1,len(parts),2):
+            parts[i] = (parts[i][0] == 'n', int(parts[i][1:]))
+        return parts
+
+    @staticmethod
+    def _fill(parts,names,base,escapes=None):
+        out = []
+        for i,p in enumerate(parts):
+            if i % 2 == 0:
+                out.append(p)
+                continue
+            is_name, n = p
+            val = names[n] if is_name else _int2hex(base + n)
+            out.append(escapes[i](val) if escapes else val)
+        return ''.join(out)
+
+    def instantiate(self,root,uid_counter,names):
+        """
+        Adds a copy of the network to root, names are the source step followed by the dest steps
+        """
+        base = uid_counter.uid
+        uid_counter.uid += self.n_ids
+
+        elem = copy.deepcopy(self.elem)
+        elems = list(elem.iter())
+        for pos,attr,parts in self.slots:
+            val = self._fill(parts,names,base)
+            if attr is None:
+                elems[pos].text = val
+            else:
+                elems[pos].attrib[attr] = val
+        root.append(elem)
+        return elem
+
+    def render(self,uid_counter,names):
+        """
+        Returns the network as indented XML text, without adding it to any tree
+        """
+        base = uid_counter.uid
+        uid_counter.uid += self.n_ids
+        return self._fill(self.pieces,names,base,self.escapes)
+
+
+@functools.lru_cache(maxsize=128)
+def _step_network_template(fanout,cultures):
+    """
+    Template of a step network with fanout destination steps
+    """
+    names = [_MARK + 'n' + str(i) + _MARK for i in range(fanout+1)]
+    uid = UidCounter(0)
+    elem = _write_step_network(ET.Element('root'),names[0],names[1:],uid,list(cultures))
+    for el in elem.iter():
+        if 'ID' in el.attrib:
+            el.attrib['ID'] = _MARK + 'i' + str(int(el.attrib['ID'],16)) + _MARK
+    return _NetworkTemplate(elem,uid.uid)
+
+
+def _write_step_network(root,src_step, dest_steps,uid_counter,cultures=CULTURES):
     """
     Writes a network for a step in the state machine
     It contains a single src_step and multiple dest_steps
@@ -590,12 +2416,12 @@ def _write_step_network(root,src_step, dest_steps,uid_counter):
     for d in dest_steps:
         comment_str += '\t -> ' + str(d) + ' \n'
 
-    _create_multilingual_text(obj_list,uid_counter,'Comment',comment_str)
-    _create_multilingual_text(obj_list,uid_counter,'Title',src_step)
+    _create_multilingual_text(obj_list,uid_counter,'Comment',comment_str,cultures)
+    _create_multilingual_text(obj_list,uid_counter,'Title',src_step,cultures)
 
     return sw
 
-def _create_multilingual_text(root,id_counter,type,text):
+def _create_multilingual_text(root,id_counter,type,text,cultures=CULTURES):
     """
     Creates multilingual text elements for each language
     for network titles and comments
@@ -607,7 +2433,9 @@ def _create_multilingual_text(root,id_counter,type,text):
 
     obj_list = ET.SubElement(mlt, "ObjectList")
 
-    cultures = ['sv-SE','de-DE','en-US','es-ES','fr-FR','it-IT','ja-JP','zh-CN']
+    # The text is the same in all languages, one element is shared by all items
+    text_elem = ET.Element("Text")
+    text_elem.text = text
 
     for c in cultures:
         mlt_item = ET.SubElement(obj_list, "MultilingualTextItem")
@@ -617,33 +2445,106 @@ def _create_multilingual_text(root,id_counter,type,text):
         attr_list = ET.SubElement(mlt_item, "AttributeList")
         cult = ET.SubElement(attr_list, "Culture")
         cult.text = c
-        text_elem = ET.SubElement(attr_list, "Text")
-        text_elem.text = text
+        attr_list.append(text_elem)
 
-def _create_multilanguageComment_blk_io(root,text):
+def _create_multilanguageComment_blk_io(root,text,cultures=CULTURES):
     """
     Adds comment to a block i/o signal
     """
 
     comment = ET.SubElement(root,"Comment")
 
-    cultures = ['sv-SE','de-DE','en-US','es-ES','fr-FR','it-IT','ja-JP','zh-CN']
-
     for c in cultures:
         mlt = ET.SubElement(comment,"MultiLanguageText")
         mlt.attrib['Lang'] = c
         mlt.text = text
 
 
-def render_graph(events:list[Event],init_state:str,fname:str,clean_event_names=True):
+def render_graph(events:list[Event],init_state:str,fname:str,clean_event_names=True,profile=None,
+                 view=True,format='pdf',engine='dot',cluster=None,cache_dir=None):
     """
     Renders a graph of the state machine to a pdf file
+    profile is an optional ExportProfile that records the time of each phase
+    view=False only renders the file, without opening a viewer, e.g. in CI
+    format is any graphviz output format, e.g. 'pdf', 'svg' or 'png'
+    engine is the graphviz layout engine, 'sfdp' is much faster than 'dot' for large graphs
+    cluster groups states into subgraphs:
+        'scc'    - strongly connected components
+        'prefix' - the part of the state name before the first '_'
+        a dict state -> group name, or a function of the state name
+    With cache_dir set the rendered file is stored in cache_dir keyed on a hash
+    of the DOT source, and graphviz only runs when the graph has changed
+    Returns the path of the rendered file
+    """
+    prof = profile if profile is not None else _NoProfile()
+    prof.context = fname
+
+    with prof.phase('clean_names') as rec:
+        graph = _as_graph(events,clean=clean_event_names)
+        if clean_event_names:
+            init_state = _clean_str(init_state)
+        rec['states'] = len(graph.states)
+        rec['events'] = len(graph.events)
+
+    with prof.phase('digraph') as rec:
+        f = _create_digraph(graph,init_state,fname,format,engine,cluster)
+        if profile is not None:
+            rec['dot_bytes'] = len(f.source.encode('utf-8'))
+
+    with prof.phase('render') as rec:
+        if cache_dir is None:
+            out = f.render(view=view)
+        else:
+            out, rec['hit'] = _render_cached(f,cache_dir)
+            if view:
+                import graphviz
+                graphviz.view(out)
+    return out
+
+
+_render_pool = None
+
+def render_graph_async(events:list[Event],init_state:str,fname:str,**kwargs):
     """
+    Runs render_graph in a background thread, without a viewer unless view=True is given.
+    Returns a concurrent.futures.Future with the path of the rendered file
+    """
+    global _render_pool
+    if _render_pool is None:
+        from concurrent.futures import ThreadPoolExecutor
+        _render_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix='render_graph')
+    kwargs.setdefault('view',False)
+    return _render_pool.submit(render_graph,events,init_state,fname,**kwargs)
 
-    if clean_event_names:
-        events = clean_names(events)
-        init_state = _clean_str(init_state)
-    f = graphviz.Digraph('finite_state_machine', filename=fname,format='pdf')
+
+def _render_cached(f,cache_dir):
+    """
+    Renders f unless a file rendered from the same DOT source is in cache_dir.
+    Returns the path of the output file and whether it came from the cache
+    """
+    key = hashlib.sha256((f.engine + '\n' + f.format + '\n' + f.source).encode('utf-8')).hexdigest()
+    cached = os.path.join(cache_dir, key + '.' + f.format)
+    out = f.filepath + '.' + f.format
+    hit = os.path.exists(cached)
+    if hit:
+        f.save()
+        shutil.copyfile(cached,out)
+    else:
+        out = f.render()
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = cached + '.' + str(os.getpid()) + '.tmp'
+        shutil.copyfile(out,tmp)
+        os.replace(tmp,cached)
+    return out, hit
+
+
+def _create_digraph(graph,init_state,fname,format='pdf',engine='dot',cluster=None):
+    """
+    Creates the graphviz graph of a state machine, without rendering it
+    """
+    # Imported here so exports do not pay for graphviz
+    import graphviz
+    f = graphviz.Digraph('finite_state_machine', filename=fname,format=format,engine=engine)
     # LR = Horizontal, TB = Vertical
     f.attr(rankdir='TB')
 
@@ -652,9 +2553,136 @@ def render_graph(events:list[Event],init_state:str,fname:str,clean_event_names=T
 
     #f.attr('node', shape='circle')
     f.attr('node',shape='')
-    for e in events:
+
+    if cluster is not None:
+        for i,(name,states) in enumerate(_state_groups(graph,cluster).items()):
+            if len(states) < 2:
+                continue
+            with f.subgraph(name='cluster_' + str(i)) as c:
+                c.attr(label=str(name))
+                for s in states:
+                    c.node(s)
+
+    for e in graph.events:
         f.edge(e.src, e.dest, label=e.trigger)
 
-    f.view()
+    return f
+
+
+def _state_groups(graph,cluster):
+    """
+    Groups the states for render_graph, returns group name -> states
+    """
+    groups = {}
+    if cluster == 'scc':
+        from analysis import strongly_connected_components
+        succ = [[graph.index[e.dest] for e in out] for out in graph.outgoing]
+        for i,scc in enumerate(reversed(strongly_connected_components(succ))):
+            groups['SCC ' + str(i)] = [graph.states[v] for v in sorted(scc)]
+        return groups
+
+    if cluster == 'prefix':
+        group_of = lambda s: s.split('_')[0]
+    elif isinstance(cluster,dict):
+        group_of = cluster.get
+    elif callable(cluster):
+        group_of = cluster
+    else:
+        raise ValueError('Unknown cluster: ' + str(cluster))
+
+    for s in graph.states:
+        g = group_of(s)
+        if g is not None:
+            groups.setdefault(g,[]).append(s)
+    return groups
 
 
+def main(argv=None):
+    """
+    Command line interface
+        python graph2LAD.py batch jobs.json [-j N] [--cache DIR] [--bundle ARCHIVE]
+        python graph2LAD.py export events.csv INIT Title fname fb_nr [--language SCL] [--render svg]
+        python graph2LAD.py watch jobs.json [--render svg] [--interval 0.05]
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='graph2LAD', description='State machine generation for Siemens TIA-Portal')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    batch = sub.add_parser('batch', help='export many state machines in parallel')
+    batch.add_argument('jobs', help='JSON file with export jobs')
+    batch.add_argument('-j', '--jobs-parallel', type=int, default=None, dest='workers',
+                       help='number of worker processes, default is the number of cores')
+    batch.add_argument('--cache', default=None, metavar='DIR',
+                       help='reuse unchanged exports from this cache directory')
+    batch.add_argument('--bundle', default=None, metavar='ARCHIVE',
+                       help='write all FBs to one .zip or .tar.gz archive with a manifest')
+
+    export = sub.add_parser('export', help='export one state machine from an event file')
+    export.add_argument('events', help='CSV, JSON or YAML event file')
+    export.add_argument('init_state')
+    export.add_argument('title')
+    export.add_argument('fname', help='output file name without .xml')
+    export.add_argument('fb_nr', type=int)
+    export.add_argument('--language', default='LAD', choices=['LAD','SCL'])
+    export.add_argument('--state-flags', default=None, choices=['Word','DWord'],
+                        help='add bit-packed state flags and a transition counter as outputs')
+    export.add_argument('--stations', type=int, default=None, metavar='N',
+                        help='run N identical stations in one FB, writes fname_DB.xml too')
+    export.add_argument('--render', default=None, metavar='FORMAT',
+                        help='also render the graph, e.g. pdf or svg')
+
+    watch = sub.add_parser('watch', help='re-export the jobs of a job file whenever they change')
+    watch.add_argument('jobs', help='JSON file with export jobs')
+    watch.add_argument('--render', default=None, metavar='FORMAT',
+                       help='also render changed graphs, e.g. pdf or svg')
+    watch.add_argument('--interval', type=float, default=0.05,
+                       help='seconds between checks for changes')
+    watch.add_argument('--cache', default=None, metavar='DIR',
+                       help='reuse unchanged exports from this cache directory')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'export':
+        from event_io import load_events
+        try:
+            events = load_events(args.events)
+            export_graph(events,args.init_state,args.title,args.fname,args.fb_nr,language=args.language,
+                         state_flags=args.state_flags,stations=args.stations)
+            if args.render is not None:
+                render_graph(events,args.init_state,args.fname,view=False,format=args.render)
+        except (OSError,ValueError) as e:
+            parser.error(str(e))
+        return 0
+
+    if args.command == 'watch':
+        print('Watching ' + args.jobs + ', Ctrl-C to stop')
+        watch_jobs(args.jobs,interval=args.interval,render=args.render,cache_dir=args.cache)
+        return 0
+
+    if args.command == 'batch':
+        t0 = time.perf_counter()
+        try:
+            jobs = load_jobs(args.jobs)
+            if args.cache is not None:
+                for j in jobs:
+                    j.options.setdefault('cache_dir',args.cache)
+            if args.bundle is not None:
+                results = export_bundle(jobs,args.bundle,max_workers=args.workers)
+            else:
+                results = export_graphs(jobs,max_workers=args.workers)
+        except ValueError as e:
+            parser.error(str(e))
+        failed = 0
+        for r in results:
+            status = 'OK' if r.error is None else 'ERROR'
+            print('FB' + str(r.fb_nr) + '\t' + '%.3fs' % r.seconds + '\t' + status + '\t' + r.fname)
+            if r.error is not None:
+                failed += 1
+                print(r.error, file=sys.stderr)
+        print(str(len(results)) + ' jobs, ' + str(failed) + ' failed, ' + '%.3fs' % (time.perf_counter() - t0))
+        return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
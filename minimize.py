@@ -0,0 +1,124 @@
+from collections import deque
+from dataclasses import replace
+
+from graph2LAD import Event, _as_graph
+
+
+def minimize(events:list[Event],init_state:str):
+    """
+    Merges equivalent states before export_graph/render_graph.
+    Two states are equivalent when their outgoing events, in network order, have the
+    same triggers and lead to equivalent states, so the generated FB reacts the same
+    to every combination of triggers. Each group of equivalent states is replaced by
+    the state of the group that comes first in the exported order.
+    Returns the new event list and a dict from every old state name to its merged name.
+    """
+    graph = _as_graph(events)
+    blocks = equivalent_states(graph)
+
+    order = {}
+    if init_state in graph:
+        for s in graph.sorted_states(init_state):
+            order[s] = len(order)
+    for s in graph.states:
+        order.setdefault(s,len(order))
+
+    mapping = {}
+    for block in blocks:
+        names = [graph.states[v] for v in block]
+        rep = min(names,key=order.__getitem__)
+        for s in names:
+            mapping[s] = rep
+
+    merged = []
+    for e in graph.events:
+        if mapping[e.src] != e.src:
+            # Same behaviour as the representative, which keeps its own events
+            continue
+        if mapping[e.dest] != e.dest:
+            e = replace(e,dest=mapping[e.dest])
+        merged.append(e)
+
+    return merged, mapping
+
+
+def equivalent_states(events):
+    """
+    Partition refinement in the style of Hopcroft, O(m log n).
+    The k:th outgoing event in network order (see TransitionGraph.transitions) of a
+    state with trigger t is a transition labelled (k, t),
+    which makes the state machine a partial DFA. The initial partition groups states
+    with the same labels, so a missing transition never has to be handled as a sink.
+    Returns the blocks of equivalent states as lists of state indices of the TransitionGraph.
+    """
+    graph = _as_graph(events)
+    n = len(graph.states)
+
+    letters = {}
+    # inverse[a][t] = states with an a-transition to t
+    inverse = []
+    # letters of the transitions into each state
+    in_letters = [set() for _ in range(n)]
+
+    groups = {}
+    for v,state in enumerate(graph.states):
+        out = graph.transitions(state)
+        signature = []
+        for k,e in enumerate(out):
+            a = letters.setdefault((k,e.trigger),len(letters))
+            if a == len(inverse):
+                inverse.append({})
+            t = graph.index[e.dest]
+            inverse[a].setdefault(t,[]).append(v)
+            in_letters[t].add(a)
+            signature.append(a)
+        groups.setdefault(tuple(signature),[]).append(v)
+
+    block_of = [0]*n
+    blocks = []
+    for members in groups.values():
+        for v in members:
+            block_of[v] = len(blocks)
+        blocks.append(set(members))
+
+    work = deque()
+    in_work = set()
+    for b,members in enumerate(blocks):
+        for a in set().union(*(in_letters[v] for v in members)):
+            work.append((b,a))
+            in_work.add((b,a))
+
+    while work:
+        splitter = work.popleft()
+        in_work.discard(splitter)
+        b,a = splitter
+
+        # States with an a-transition into the splitter block, grouped by their block
+        touched = {}
+        inv = inverse[a]
+        for t in blocks[b]:
+            for v in inv.get(t,()):
+                touched.setdefault(block_of[v],set()).add(v)
+
+        for y,xs in touched.items():
+            block = blocks[y]
+            if len(xs) == len(block):
+                continue
+
+            # The smaller half gets the new block id
+            part = xs if 2*len(xs) <= len(block) else block - xs
+            block -= part
+            new = len(blocks)
+            blocks.append(part)
+            for v in part:
+                block_of[v] = new
+
+            # If (y, c) is waiting both halves must be processed, otherwise the
+            # smaller half is enough. Both cases add (new, c), and only letters
+            # with transitions into the new block can split anything.
+            for c in set().union(*(in_letters[v] for v in part)):
+                if (new,c) not in in_work:
+                    work.append((new,c))
+                    in_work.add((new,c))
+
+    return [sorted(block) for block in blocks]
@@ -0,0 +1,389 @@
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass, field
+import functools
+
+from graph2LAD import Event, _as_graph, _clean_str
+
+
+@dataclass
+class ImportedFB:
+    """
+    State machine read back from a Simatic ML file written by export_graph,
+    possibly edited in TIA since. Triggers are the contact operands (LAD) or IF
+    conditions (SCL) of the transitions, '' where they are still FALSE
+    """
+    name:str = None
+    number:int = None
+    title:str = None
+    language:str = None                              # language of the step networks, 'LAD' or 'SCL'
+    init_state:str = None
+    constants:dict = field(default_factory=dict)     # state -> step value
+    events:list = field(default_factory=list)
+    members:dict = field(default_factory=dict)       # interface section -> member names
+    other_networks:list = field(default_factory=list) # titles of networks that are not part of the state machine
+
+    @property
+    def states(self):
+        """
+        States sorted by step value
+        """
+        return sorted(self.constants,key=self.constants.__getitem__)
+
+
+@dataclass
+class FBDiff:
+    """
+    Structural difference between an imported FB and a new design,
+    states are the cleaned names used in the FB
+    """
+    added_states:list = field(default_factory=list)
+    removed_states:list = field(default_factory=list)
+    renumbered:dict = field(default_factory=dict)     # state -> (old step value, new step value)
+    added_events:list = field(default_factory=list)   # (src, dest)
+    removed_events:list = field(default_factory=list) # (src, dest)
+    changed_states:list = field(default_factory=list) # states whose step network has to be replaced
+    init_changed:bool = False
+
+    @property
+    def unchanged(self):
+        return not (self.added_states or self.removed_states or self.renumbered or
+                    self.added_events or self.removed_events or self.changed_states or self.init_changed)
+
+    def summary(self):
+        """
+        Human readable list of the differences
+        """
+        lines = []
+        if self.init_changed:
+            lines.append('Init state changed')
+        for s in self.added_states:
+            lines.append('Added state: ' + s)
+        for s in self.removed_states:
+            lines.append('Removed state: ' + s)
+        for s,(old,new) in self.renumbered.items():
+            lines.append('Renumbered state: ' + s + ' ' + str(old) + ' -> ' + str(new))
+        for src,dest in self.added_events:
+            lines.append('Added transition: ' + src + ' -> ' + dest)
+        for src,dest in self.removed_events:
+            lines.append('Removed transition: ' + src + ' -> ' + dest)
+        for s in self.changed_states:
+            lines.append('Changed network: ' + s)
+        return lines
+
+
+def import_fb(source)->ImportedFB:
+    """
+    Reads an FB written by export_graph from a file name or file object.
+    The file is parsed with iterparse and each network is cleared once it
+    has been read, so large exports are never fully in memory
+    """
+    fb = ImportedFB()
+    for _,elem in ET.iterparse(source):
+        tag = _local(elem.tag)
+
+        if tag == 'SW.Blocks.CompileUnit':
+            _read_network(fb,elem)
+            elem.clear()
+
+        elif tag == 'Section':
+            names = []
+            for m in elem:
+                if _local(m.tag) != 'Member':
+                    continue
+                names.append(m.get('Name'))
+                if elem.get('Name') == 'Constant':
+                    value = _child(m,'StartValue')
+                    fb.constants[m.get('Name')] = int(value.text) if value is not None else None
+            fb.members[elem.get('Name')] = names
+            elem.clear()
+
+        elif tag == 'AttributeList' and _child(elem,'Interface') is not None:
+            # Attributes of the FB
+            name = _child(elem,'Name')
+            number = _child(elem,'Number')
+            fb.name = name.text if name is not None else None
+            fb.number = int(number.text) if number is not None else None
+            elem.clear()
+
+        elif tag == 'SW.Blocks.FB':
+            # Only the block comment and title are left, the networks are cleared
+            for mlt in _children(elem,'ObjectList'):
+                if _local(mlt.tag) == 'MultilingualText' and mlt.get('CompositionName') == 'Title':
+                    fb.title = _multilingual_text(mlt)
+            elem.clear()
+
+    if fb.init_state is None and len(fb.constants) > 0:
+        fb.init_state = fb.states[0]
+    return fb
+
+
+def diff_fb(imported:ImportedFB,events:list[Event],init_state:str)->FBDiff:
+    """
+    Compares an imported FB with a new design, lists what has to be
+    re-exported. Transitions are compared by source and destination in
+    network order, the triggers of an edited FB are signals and not the
+    names of the design
+    """
+    graph = _as_graph(events,clean=True)
+    init_state = _clean_str(init_state)
+    states = graph.sorted_states(init_state)
+    new_values = {s:i*10 for i,s in enumerate(states)}
+    old_values = imported.constants
+
+    d = FBDiff()
+    d.init_changed = imported.init_state != init_state
+    d.added_states = [s for s in states if s not in old_values]
+    d.removed_states = [s for s in imported.states if s not in new_values]
+    for s in states:
+        if s in old_values and old_values[s] != new_values[s]:
+            d.renumbered[s] = (old_values[s],new_values[s])
+
+    old_out = {}
+    for e in imported.events:
+        old_out.setdefault(e.src,[]).append(e.dest)
+    new_out = {s:[e.dest for e in graph.transitions(s)] for s in states}
+
+    old_pairs = {(src,dest) for src,dests in old_out.items() for dest in dests}
+    new_pairs = {(src,dest) for src,dests in new_out.items() for dest in dests}
+    d.added_events = [(s,dest) for s in states for dest in new_out[s] if (s,dest) not in old_pairs]
+    d.removed_events = [e for e in ((e.src,e.dest) for e in imported.events) if e not in new_pairs]
+
+    for s in list(dict.fromkeys(states + imported.states)):
+        if old_out.get(s,[]) != new_out.get(s,[]):
+            d.changed_states.append(s)
+    return d
+
+
+@functools.lru_cache(maxsize=None)
+def _local(tag):
+    """
+    Tag without namespace, the network sources have their own xmlns
+    """
+    return tag.rsplit('}',1)[-1]
+
+
+def _child(elem,tag):
+    for c in elem:
+        if _local(c.tag) == tag:
+            return c
+    return None
+
+
+def _children(elem,tag):
+    """
+    Children of the child tag of elem, empty if there is none
+    """
+    c = _child(elem,tag)
+    return list(c) if c is not None else []
+
+
+def _multilingual_text(mlt):
+    """
+    Text of a MultilingualText, en-US if there is one, else the first culture
+    """
+    texts = {}
+    for item in mlt.iter():
+        if _local(item.tag) != 'AttributeList':
+            continue
+        culture = _child(item,'Culture')
+        text = _child(item,'Text')
+        if culture is not None and text is not None:
+            texts.setdefault(culture.text,text.text or '')
+    return texts.get('en-US',next(iter(texts.values()),None))
+
+
+def _read_network(fb,unit):
+    """
+    Adds the events of a step network to fb, finds the init state in the reset
+    network and records the title of any other network
+    """
+    source = None
+    for e in unit.iter():
+        if _local(e.tag) in ('FlgNet','StructuredText'):
+            source = e
+            break
+
+    found = False
+    if source is not None and _local(source.tag) == 'FlgNet':
+        found = _read_flgnet(fb,source)
+    elif source is not None:
+        found = _read_scl(fb,_scl_tokens(source))
+
+    if not found:
+        title = None
+        for e in unit.iter():
+            if _local(e.tag) == 'MultilingualText' and e.get('CompositionName') == 'Title':
+                title = _multilingual_text(e)
+                break
+        fb.other_networks.append(title)
+
+
+def _access_text(access):
+    """
+    Name of the variable or value of the constant an Access refers to
+    """
+    if access.get('Scope') == 'LiteralConstant':
+        value = None
+        for e in access.iter():
+            if _local(e.tag) == 'ConstantValue':
+                value = e.text
+        return '' if value == 'FALSE' else value
+    const = _child(access,'Constant')
+    if const is not None:
+        return const.get('Name')
+    symbol = _child(access,'Symbol')
+    if symbol is not None:
+        return '.'.join(c.get('Name') for c in symbol if _local(c.tag) == 'Component')
+    return ''
+
+
+def _read_flgnet(fb,flgnet):
+    """
+    Reads a LAD step network: statStep == SRC compared in an Eq box, which
+    feeds one contact and move of DEST to statNextStep per transition
+    """
+    access = {}
+    parts = {}
+    negated = set()
+    order = []
+    for e in _children(flgnet,'Parts'):
+        uid = e.get('UId')
+        if _local(e.tag) == 'Access':
+            access[uid] = e
+        elif _local(e.tag) == 'Part':
+            parts[uid] = e.get('Name')
+            order.append(uid)
+            if any(_local(c.tag) == 'Negated' for c in e):
+                negated.add(uid)
+
+    # (part uid, connection name) -> uids of what is wired to it
+    wired = {}
+    for wire in _children(flgnet,'Wires'):
+        ends = [(c.get('UId'),c.get('Name')) for c in wire]
+        for a in ends:
+            for b in ends:
+                if a != b:
+                    wired.setdefault(a,[]).append(b[0])
+
+    eq = [u for u in order if parts[u] == 'Eq']
+    if len(eq) != 1:
+        return False
+    src = None
+    for pin in ('in2','in1'):
+        for u in wired.get((eq[0],pin),[]):
+            if u in access and _child(access[u],'Constant') is not None and access[u].get('Scope') == 'LocalConstant':
+                src = _access_text(access[u])
+        if src is not None:
+            break
+    if src is None:
+        return False
+
+    for m in order:
+        if parts[m] != 'Move':
+            continue
+        dest = [_access_text(access[u]) for u in wired.get((m,'in'),[]) if u in access]
+        if len(dest) == 0:
+            continue
+        trigger = ''
+        for c in wired.get((m,'en'),[]):
+            if parts.get(c) == 'Contact':
+                ops = [_access_text(access[u]) for u in wired.get((c,'operand'),[]) if u in access]
+                trigger = ops[0] if ops else ''
+                if c in negated and trigger:
+                    trigger = 'NOT ' + trigger
+        fb.events.append(Event(src,dest[0],trigger))
+
+    fb.language = fb.language or 'LAD'
+    return True
+
+
+def _scl_tokens(st):
+    """
+    Flattens SCL StructuredText to a list of (kind, text),
+    kind is 'token', 'const' (local constant), 'var' or 'lit'
+    """
+    tokens = []
+    def walk(elem):
+        for e in elem:
+            tag = _local(e.tag)
+            if tag == 'Token':
+                tokens.append(('token',e.get('Text')))
+            elif tag == 'Access':
+                scope = e.get('Scope')
+                if scope == 'LocalConstant':
+                    tokens.append(('const',_access_text(e)))
+                elif scope == 'LiteralConstant':
+                    tokens.append(('lit',_access_text(e)))
+                elif scope == 'Call':
+                    tokens.append(('token','CALL'))
+                else:
+                    tokens.append(('var',_access_text(e)))
+            elif tag not in ('Blank','NewLine','LineComment','Text'):
+                walk(e)
+    walk(st)
+    return tokens
+
+
+def _read_scl(fb,tokens):
+    """
+    Reads the SCL reset network (IF reset THEN statStep := INIT ...), the
+    CASE network of language='SCL' (SRC: IF cond THEN statNextStep := DEST; ELSIF ... END_IF;)
+    or the FOR loop over both of stations=n,
+    returns False for networks that are not generated by export_graph.
+    An ELSIF chain stops at the first transition that fires, so its events are
+    added in reverse, in network order where the last one wins
+    """
+    texts = [t for _,t in tokens]
+    if texts[:1] == ['FOR'] and 'CASE' in texts and 'DO' in texts:
+        # Station loop of stations=n, the reset network followed by the CASE network
+        case = texts.index('CASE')
+        _read_scl(fb,tokens[texts.index('DO')+1:case])
+        return _read_scl(fb,tokens[case:])
+    if texts[:2] == ['IF','enable'] or 'statDwellTime' in texts or 'statFlagStep' in texts:
+        # 'Next step', instrumentation and state flags networks
+        return True
+    if texts[:2] == ['IF','reset'] and 'statStep' in texts:
+        i = texts.index('statStep')
+        if i + 2 < len(tokens) and tokens[i+2][0] == 'const':
+            fb.init_state = tokens[i+2][1]
+            return True
+        return False
+
+    if len(tokens) < 3 or tokens[0] != ('token','CASE') or texts[1] != 'statStep':
+        return False
+
+    src = None
+    cond = None
+    block = []
+    chain = False
+    i = 3
+    while i < len(tokens):
+        kind,text = tokens[i]
+        if kind == 'const' and i + 1 < len(tokens) and tokens[i+1] == ('token',':') and cond is None:
+            src = text
+            i += 2
+            continue
+        if kind == 'token' and text in ('IF','ELSIF'):
+            if text == 'IF':
+                block = []
+            chain = chain or text == 'ELSIF'
+            j = i + 1
+            while j < len(tokens) and tokens[j] != ('token','THEN'):
+                j += 1
+            cond = ' '.join(t for _,t in tokens[i+1:j] if t != '')
+            i = j + 1
+            continue
+        if kind == 'token' and text == 'END_IF':
+            fb.events.extend(reversed(block) if chain else block)
+            block = []
+            chain = False
+            cond = None
+        if (kind == 'var' and text == 'statNextStep' and src is not None and i + 2 < len(tokens)
+                and tokens[i+1] == ('token',':=') and tokens[i+2][0] == 'const'):
+            block.append(Event(src,tokens[i+2][1],cond or ''))
+            i += 3
+            continue
+        i += 1
+
+    fb.language = fb.language or 'SCL'
+    return True
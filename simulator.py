@@ -0,0 +1,219 @@
+import numpy as np
+from dataclasses import dataclass
+
+from graph2LAD import Event, _as_graph, _clean_str
+
+
+class CompiledMachine:
+    """
+    Integer transition table of a state machine,
+    states are numbered as in the FB generated by export_graph (step value = index*10)
+    """
+    def __init__(self,events:list[Event],init_state:str):
+        graph = _as_graph(events,clean=True)
+        init_state = _clean_str(init_state)
+
+        # Only states reachable from init_state get a constant and a network
+        self.states = graph.sorted_states(init_state)
+        self.step_values = np.arange(len(self.states),dtype=np.int32)*10
+        index = {s:i for i,s in enumerate(self.states)}
+        self.unreachable = [s for s in graph.states if s not in index]
+        self.triggers = []
+        trigger_ids = {}
+
+        out_evs = [graph.transitions(s) for s in self.states]
+        fanout = max([len(o) for o in out_evs] + [1])
+
+        # dest[i,k] is the k:th transition of state i in network order, -1 if none
+        self.dest = np.full((len(self.states),fanout),-1,dtype=np.int32)
+        # trigger[i,k] is the trigger id of that transition
+        self.trigger = np.full((len(self.states),fanout),-1,dtype=np.int32)
+        # column of the first transition in the state with the same trigger,
+        # so a trigger that appears twice in a state is sampled once
+        self.alias = np.tile(np.arange(fanout,dtype=np.int32),(len(self.states),1))
+
+        for i,evs in enumerate(out_evs):
+            first_col = {}
+            for k,e in enumerate(evs):
+                t = trigger_ids.get(e.trigger)
+                if t is None:
+                    t = len(self.triggers)
+                    trigger_ids[e.trigger] = t
+                    self.triggers.append(e.trigger)
+                self.dest[i,k] = index[e.dest]
+                self.trigger[i,k] = t
+                self.alias[i,k] = first_col.setdefault(t,k)
+
+        self.deadlocks = [s for s,evs in zip(self.states,out_evs) if len(evs) == 0]
+
+    @property
+    def fanout(self):
+        return self.dest.shape[1]
+
+
+@dataclass
+class SimulationReport:
+    """
+    Result of a simulation, all arrays are indexed like states
+    """
+    states:list
+    step_values:np.ndarray
+    instances:int
+    cycles:int
+    occupancy:np.ndarray     # instance-cycles spent in each state, counted at end of cycle
+    reach_count:np.ndarray   # number of instances that reached each state
+    reach_min:np.ndarray     # first cycle a state was reached, over the instances (-1 if never)
+    reach_mean:np.ndarray
+    reach_max:np.ndarray
+    unreachable:list         # states in the events that cannot be reached from init_state
+    deadlocks:list           # reachable states without outgoing events
+    never_visited:list       # reachable states no instance entered during the simulation
+    deadlocked_instances:int # instances that ended the simulation in a deadlock state
+
+    def occupancy_histogram(self):
+        """
+        Fraction of the simulated time spent in each state
+        """
+        total = max(int(self.occupancy.sum()),1)
+        return {s:float(n)/total for s,n in zip(self.states,self.occupancy)}
+
+
+class Simulator:
+    """
+    Runs a batch of instances of the generated FB, one PLC cycle at a time:
+        1. reset network: statStep := statNextStep := init state
+        2. step networks: each firing transition of the active state writes statNextStep,
+           the last firing transition in network order wins
+        3. next step network: IF enable THEN statStep := statNextStep
+    Triggers, enable and reset are random inputs. trigger_prob is a probability
+    for all triggers or a dict trigger -> probability.
+    """
+    def __init__(self,events:list[Event],init_state:str,instances=1000,
+                 trigger_prob=0.1,enable_prob=1.0,reset_prob=0.0,seed=None):
+        self.machine = m = CompiledMachine(events,init_state)
+        self.instances = instances
+        self.enable_prob = enable_prob
+        self.reset_prob = reset_prob
+        self.rng = np.random.default_rng(seed)
+
+        probs = np.empty(len(m.triggers)+1)
+        probs[-1] = 0.0 # padding columns never fire
+        for t,name in enumerate(m.triggers):
+            probs[t] = trigger_prob.get(name,0.0) if isinstance(trigger_prob,dict) else trigger_prob
+        # firing probability per state and column
+        self._prob = probs[m.trigger]
+
+        n_states = len(m.states)
+        # All static variables start at 0, which is the init state
+        self.step = np.zeros(instances,dtype=np.int32)
+        self.next_step = np.zeros(instances,dtype=np.int32)
+        self.cycle = 0
+
+        self.occupancy = np.zeros(n_states,dtype=np.int64)
+        self.visited = np.zeros((instances,n_states),dtype=bool)
+        self.visited[:,0] = True
+        self.reach_count = np.zeros(n_states,dtype=np.int64)
+        self.reach_count[0] = instances
+        self.reach_sum = np.zeros(n_states,dtype=np.float64)
+        self.reach_min = np.full(n_states,-1,dtype=np.int64)
+        self.reach_min[0] = 0
+        self.reach_max = np.full(n_states,-1,dtype=np.int64)
+        self.reach_max[0] = 0
+
+    def run(self,cycles,block=256):
+        """
+        Advances all instances a number of PLC cycles, can be called repeatedly
+        """
+        m = self.machine
+        n = self.instances
+        rows = np.arange(n)
+        done = 0
+        while done < cycles:
+            b = min(block,cycles - done)
+            # Random inputs for a block of cycles at once
+            rand = self.rng.random((b,n,m.fanout))
+            enable = self.rng.random((b,n)) < self.enable_prob
+            if self.reset_prob > 0:
+                reset = self.rng.random((b,n)) < self.reset_prob
+            else:
+                reset = None
+
+            for c in range(b):
+                step = self.step
+                nxt = self.next_step
+
+                # Reset network
+                if reset is not None:
+                    r = reset[c]
+                    step[r] = 0
+                    nxt[r] = 0
+
+                # Step networks
+                prob = self._prob[step]
+                alias = m.alias[step]
+                fired = np.take_along_axis(rand[c],alias,axis=1) < prob
+                dest = m.dest[step]
+                for k in range(m.fanout):
+                    nxt = np.where(fired[:,k],dest[:,k],nxt)
+
+                # Next step network
+                new_step = np.where(enable[c],nxt,step)
+
+                self.cycle += 1
+                self._record(rows,new_step)
+                self.step = new_step
+                self.next_step = nxt.astype(np.int32,copy=False)
+
+            done += b
+        return self
+
+    def _record(self,rows,step):
+        """
+        Updates occupancy and first reach statistics after a cycle
+        """
+        self.occupancy += np.bincount(step,minlength=len(self.occupancy))
+
+        first = ~self.visited[rows,step]
+        if first.any():
+            idx = rows[first]
+            st = step[first]
+            self.visited[idx,st] = True
+            cyc = self.cycle
+            np.add.at(self.reach_count,st,1)
+            np.add.at(self.reach_sum,st,cyc)
+            unset = self.reach_min[st] < 0
+            self.reach_min[st[unset]] = cyc
+            self.reach_max[st] = cyc
+
+    def report(self)->SimulationReport:
+        m = self.machine
+        with np.errstate(invalid='ignore',divide='ignore'):
+            reach_mean = np.where(self.reach_count > 0,self.reach_sum / self.reach_count,np.nan)
+
+        dead = m.dest[:,0] < 0
+
+        return SimulationReport(
+            states=list(m.states),
+            step_values=m.step_values,
+            instances=self.instances,
+            cycles=self.cycle,
+            occupancy=self.occupancy.copy(),
+            reach_count=self.reach_count.copy(),
+            reach_min=self.reach_min.copy(),
+            reach_mean=reach_mean,
+            reach_max=self.reach_max.copy(),
+            unreachable=list(m.unreachable),
+            deadlocks=list(m.deadlocks),
+            never_visited=[s for s,c in zip(m.states,self.reach_count) if c == 0],
+            deadlocked_instances=int(dead[self.step].sum()),
+        )
+
+
+def simulate(events:list[Event],init_state:str,cycles=10000,instances=1000,
+             trigger_prob=0.1,enable_prob=1.0,reset_prob=0.0,seed=None)->SimulationReport:
+    """
+    Simulates a batch of instances of the generated FB and returns the statistics
+    """
+    sim = Simulator(events,init_state,instances=instances,trigger_prob=trigger_prob,
+                    enable_prob=enable_prob,reset_prob=reset_prob,seed=seed)
+    return sim.run(cycles).report()
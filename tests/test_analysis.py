@@ -0,0 +1,27 @@
+"""
+Checks of analysis.analyze
+"""
+import os
+import sys
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analysis
+from graph2LAD import Event
+
+
+def test_long_chain_reports_dead_end_only():
+    events = [Event('S%d' % i,'S%d' % (i+1),'') for i in range(10000)]
+    report = analysis.analyze(events,'S0')
+    assert report.dead_ends == ['S10000']
+    assert report.non_returning == []
+    assert report.summary() == ['Dead end state: S10000']
+
+
+def test_non_returning_cycles():
+    events = [Event('A','B',''),Event('B','C',''),Event('C','B',''),Event('C','A',''),
+              Event('A','F',''),Event('F','G',''),Event('G','F',''),Event('F','H',''),Event('H','H','')]
+    report = analysis.analyze(events,'A')
+    assert sorted(report.non_returning) == [['F','G'],['H']]
+    assert report.dead_ends == []
+    assert report.ok
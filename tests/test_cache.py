@@ -0,0 +1,64 @@
+"""
+Checks of the export cache of export_graph
+"""
+import os
+import sys
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import graph2LAD
+from graph2LAD import Event
+
+EVENTS = [Event('INIT','GOTO_HOME','init to home'),
+          Event('GOTO_HOME','WORKING','Reached home pos'),
+          Event('WORKING','INIT','Done')]
+
+
+def _phases(profile,name):
+    return [r for r in profile.phases if r['phase'] == name]
+
+
+def test_cache_hit_is_identical(tmp_path):
+    cache = str(tmp_path / 'cache')
+    profile = graph2LAD.ExportProfile()
+    graph2LAD.export_graph(EVENTS,'INIT','T',str(tmp_path / 'a'),45,cache_dir=cache,profile=profile)
+    graph2LAD.export_graph(EVENTS,'INIT','T',str(tmp_path / 'b'),45,cache_dir=cache,profile=profile)
+    assert [r['hit'] for r in _phases(profile,'cache')] == [False,True]
+    assert len(os.listdir(cache)) == 1
+    deterministic = graph2LAD.export_graph(EVENTS,'INIT','T',None,45,deterministic=True)
+    assert (tmp_path / 'a.xml').read_bytes() == deterministic
+    assert (tmp_path / 'b.xml').read_bytes() == deterministic
+
+
+def test_unchanged_file_is_untouched(tmp_path):
+    cache = str(tmp_path / 'cache')
+    target = tmp_path / 'a.xml'
+    graph2LAD.export_graph(EVENTS,'INIT','T',str(tmp_path / 'a'),45,cache_dir=cache)
+    os.utime(target,ns=(1,1))
+    graph2LAD.export_graph(EVENTS,'INIT','T',str(tmp_path / 'a'),45,cache_dir=cache)
+    assert os.stat(target).st_mtime_ns == 1
+
+    # A changed design is a miss and rewrites the file
+    graph2LAD.export_graph(EVENTS + [Event('WORKING','GOTO_HOME','')],'INIT','T',str(tmp_path / 'a'),45,
+                           cache_dir=cache)
+    assert os.stat(target).st_mtime_ns != 1
+    assert len(os.listdir(cache)) == 2
+
+
+def test_options_change_the_key(tmp_path):
+    cache = str(tmp_path / 'cache')
+    for options in ({},{'language':'SCL'},{'cultures':['en-US']},{'instrument':True}):
+        graph2LAD.export_graph(EVENTS,'INIT','T',str(tmp_path / 'a'),45,cache_dir=cache,**options)
+        assert (tmp_path / 'a.xml').read_bytes() == \
+               graph2LAD.export_graph(EVENTS,'INIT','T',None,45,deterministic=True,**options)
+    graph2LAD.export_graph(EVENTS,'INIT','T',str(tmp_path / 'a'),46,cache_dir=cache)
+    assert len(os.listdir(cache)) == 5
+
+
+def test_station_db_is_cached(tmp_path):
+    cache = str(tmp_path / 'cache')
+    graph2LAD.export_graph(EVENTS,'INIT','T',str(tmp_path / 'a'),45,stations=3,cache_dir=cache)
+    db = tmp_path / 'a_DB.xml'
+    os.utime(db,ns=(1,1))
+    graph2LAD.export_graph(EVENTS,'INIT','T',str(tmp_path / 'a'),45,stations=3,cache_dir=cache)
+    assert os.stat(db).st_mtime_ns == 1
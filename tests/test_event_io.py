@@ -0,0 +1,94 @@
+"""
+Checks of the event file readers and writer
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import event_io
+from graph2LAD import Event
+
+EVENTS = [Event('INIT','GOTO_HOME','init to home'),
+          Event('GOTO_HOME','AT HOME, "POS"','Reached; home pos'),
+          Event('AT HOME, "POS"','INIT','')]
+
+
+@pytest.mark.parametrize('ext',['.csv','.json','.yaml'])
+@pytest.mark.parametrize('events',[EVENTS,EVENTS[:2] + [Event('AT HOME, "POS"','INIT','',priority=3)]],
+                         ids=['no priority','priority'])
+def test_round_trip(tmp_path,ext,events):
+    if ext == '.yaml':
+        pytest.importorskip('yaml')
+    path = str(tmp_path / ('events' + ext))
+    event_io.write_events(events,path)
+    assert event_io.load_events(path) == events
+
+
+def test_priority_written_only_when_used(tmp_path):
+    path = tmp_path / 'events.csv'
+    event_io.write_events(EVENTS,str(path))
+    assert path.read_text(encoding='utf-8').splitlines()[0] == 'src,dest,trigger'
+
+
+def test_semicolon_delimiter(tmp_path):
+    path = tmp_path / 'events.csv'
+    path.write_text('Src;Dest;Trigger;Note\nINIT;GOTO_HOME;a,b;x\nGOTO_HOME;INIT;;y\n',encoding='utf-8')
+    assert event_io.load_events(str(path)) == [Event('INIT','GOTO_HOME','a,b'),Event('GOTO_HOME','INIT','')]
+
+
+def test_header_columns_in_any_order(tmp_path):
+    path = tmp_path / 'events.csv'
+    path.write_text('priority,trigger,dest,src\n2,t,B,A\n,u,A,B\n',encoding='utf-8')
+    assert event_io.load_events(str(path)) == [Event('A','B','t',2),Event('B','A','u',0)]
+
+
+def test_headerless(tmp_path):
+    path = tmp_path / 'events.csv'
+    path.write_text('INIT,GOTO_HOME,go\nGOTO_HOME,INIT,back\n',encoding='utf-8')
+    assert event_io.load_events(str(path)) == [Event('INIT','GOTO_HOME','go'),Event('GOTO_HOME','INIT','back')]
+
+
+def test_headerless_priority(tmp_path):
+    path = tmp_path / 'events.csv'
+    path.write_text('INIT,GOTO_HOME,go,5\nGOTO_HOME,INIT,back,\n',encoding='utf-8')
+    assert event_io.load_events(str(path)) == [Event('INIT','GOTO_HOME','go',5),Event('GOTO_HOME','INIT','back')]
+
+
+@pytest.mark.parametrize('text,message',[
+    ('src,dest,trigger\nA,B,t\nB,t\n',':3: expected 3 columns'),
+    ('src,dest,trigger\nA,B,t\n,B,t\n',':3: empty state name'),
+    ('src,dest,trigger,priority\nA,B,t,high\n',':2: priority is not an integer'),
+])
+def test_csv_errors(tmp_path,text,message):
+    path = tmp_path / 'events.csv'
+    path.write_text(text,encoding='utf-8')
+    with pytest.raises(ValueError,match=str(path).replace('\\','\\\\') + message):
+        event_io.load_events(str(path))
+
+
+@pytest.mark.parametrize('text,message',[
+    ('[["A","B","t"],["A"]]','entry 1: expected'),
+    ('[["A","B","t"],["","B","t"]]','entry 1: state names must be non-empty'),
+    ('[["A","B","t","high"]]','entry 0: priority is not an integer'),
+    ('{"states":[]}','expected a list of events'),
+])
+def test_json_errors(tmp_path,text,message):
+    path = tmp_path / 'events.json'
+    path.write_text(text,encoding='utf-8')
+    with pytest.raises(ValueError,match=message):
+        event_io.load_events(str(path))
+
+
+def test_json_dicts(tmp_path):
+    path = tmp_path / 'events.json'
+    path.write_text('{"events":[{"src":"A","dest":"B"},{"src":"B","dest":"A","trigger":"t","priority":1}]}',
+                    encoding='utf-8')
+    assert event_io.load_events(str(path)) == [Event('A','B',''),Event('B','A','t',1)]
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        event_io.load_events('events.txt')
@@ -0,0 +1,147 @@
+"""
+Checks that the streaming writer gives the same bytes as writing the full
+tree. Run from the repository root:
+
+    python -m pytest tests
+"""
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import graph2LAD
+from graph2LAD import Event
+
+# Names that have to be escaped in attributes and text, and a title that ends
+# up in the block, network titles and multi-line comments
+TITLE = 'Line & <Station> "3"'
+EVENTS = [Event('INIT','GOTO_HOME','init to home'),
+          Event('GOTO_HOME','AT <HOME> & "POS"','Reached home pos'),
+          Event('AT <HOME> & "POS"','LOADING','Start loading'),
+          Event('LOADING','WORKING','Loading completed'),
+          Event('WORKING','UNLOADING','Work complete',priority=1),
+          Event('WORKING','INIT','Abort'),
+          Event('UNLOADING','AT <HOME> & "POS"','Unloading complete'),
+          Event('INIT','UNLOADING','Direct unloading',priority=2)]
+
+# export_graph options each streaming test runs with
+OPTIONS = [{},
+           {'language':'SCL'},
+           {'instrument':True},
+           {'language':'SCL','instrument':True},
+           {'state_flags':True},
+           {'state_flags':'Word','language':'SCL'},
+           {'stations':3}]
+
+
+def _export(streaming,**options):
+    if 'stations' in options:
+        # The FB and the instance DB
+        db = io.BytesIO()
+        data = graph2LAD.export_graph(EVENTS,'INIT',TITLE,None,45,streaming=streaming,deterministic=True,
+                                      station_db=db,**options)
+        return data,db.getvalue()
+    return graph2LAD.export_graph(EVENTS,'INIT',TITLE,None,45,streaming=streaming,deterministic=True,**options)
+
+
+@pytest.mark.parametrize('options',OPTIONS,ids=str)
+def test_streaming_is_identical(options):
+    assert _export(False,**options) == _export(True,**options)
+
+
+def test_streaming_is_identical_large():
+    events = [Event('S%d' % i,'S%d' % (i+1),'t%d' % i) for i in range(200)]
+    events += [Event('S%d' % (i*7 % 200),'S%d' % (i*13 % 200),'&<%d>' % i) for i in range(300)]
+    tree = graph2LAD.export_graph(events,'S0',TITLE,None,46,deterministic=True)
+    streamed = graph2LAD.export_graph(events,'S0',TITLE,None,46,deterministic=True,streaming=True)
+    assert tree == streamed
+
+
+def test_template_matches_tree():
+    # A step network rendered as text by its template is the same as the instantiated element
+    import xml.etree.ElementTree as ET
+    template = graph2LAD._step_network_template(3,tuple(graph2LAD.CULTURES))
+    names = ['A&B','<C>','"D"','E']
+    text = template.render(graph2LAD.UidCounter(5),names)
+    obj_list = ET.Element('ObjectList')
+    elem = template.instantiate(obj_list,graph2LAD.UidCounter(5),names)
+    ET.indent(elem,space="\t",level=3)
+    assert text == ET.tostring(elem,encoding='unicode')
+
+
+def test_instrumentation_skips_first_runtime():
+    # The first RUNTIME result is the time since CPU start and must not be added to a dwell time
+    import xml.etree.ElementTree as ET
+    import simatic_import
+    root = ET.fromstring(_export(False,instrument=True))
+    for st in root.iter('{http://www.siemens.com/automation/Openness/SW/NetworkSource/StructuredText/v3}StructuredText'):
+        texts = [t for _,t in simatic_import._scl_tokens(st)]
+        if 'statDwellTime' in texts:
+            break
+    guard = texts.index('statRuntimeValid')
+    assert texts[guard-1:guard+2] == ['IF','statRuntimeValid','THEN']
+    assert guard < texts.index('statDwellTime') < texts.index('END_IF') < texts.index('statRuntimeValid',guard+1)
+
+
+@pytest.mark.parametrize('word_type,words',[('DWord',1),('Word',1)])
+def test_state_flags_outputs(word_type,words):
+    import xml.etree.ElementTree as ET
+    root = ET.fromstring(_export(False,state_flags=word_type))
+    ns = '{http://www.siemens.com/automation/Openness/SW/Interface/v5}'
+    outputs = {m.get('Name'):m.get('Datatype') for s in root.iter(ns + 'Section') if s.get('Name') == 'Output'
+               for m in s.iter(ns + 'Member')}
+    assert outputs == {'stateFlags':'Array[0..' + str(words-1) + '] of ' + word_type,'transitionCount':'UDInt'}
+
+
+def test_state_flags_words():
+    # 40 states take two DWords or three Words
+    events = [Event('S%d' % i,'S%d' % ((i+1) % 40),'') for i in range(40)]
+    for word_type,words in (('DWord',2),('Word',3)):
+        data = graph2LAD.export_graph(events,'S0','T',None,1,deterministic=True,state_flags=word_type)
+        assert ('Array[0..' + str(words-1) + '] of ' + word_type).encode() in data
+
+
+def test_state_flags_invalid():
+    with pytest.raises(ValueError):
+        _export(False,state_flags='Byte')
+
+
+def test_stations_instance_db(tmp_path):
+    graph2LAD.export_graph(EVENTS,'INIT',TITLE,str(tmp_path / 'line'),45,stations=24,station_db_nr=145,
+                           deterministic=True)
+    db = (tmp_path / 'line_DB.xml').read_bytes()
+    assert b'<SW.Blocks.InstanceDB' in db
+    assert b'<Number>145</Number>' in db
+    assert b'Array[0..23] of Int' in db
+    assert b'tempStation' not in db
+    assert db == _export(False,stations=24,station_db_nr=145)[1]
+
+
+def test_stations_needs_db_target():
+    with pytest.raises(ValueError):
+        graph2LAD.export_graph(EVENTS,'INIT',TITLE,None,45,stations=3)
+    with pytest.raises(ValueError):
+        graph2LAD.export_graph(EVENTS,'INIT',TITLE,None,45,stations=3,station_db=io.BytesIO(),split='prefix')
+
+
+def test_stations_bundle(tmp_path):
+    import json
+    import zipfile
+    jobs = [graph2LAD.ExportJob(EVENTS,'INIT','B',str(tmp_path / 'b_FB'),5,{'stations':3,'station_db_nr':7}),
+            graph2LAD.ExportJob(EVENTS,'INIT','C',str(tmp_path / 'c_FB'),6)]
+    results = graph2LAD.export_bundle(jobs,str(tmp_path / 'line.zip'),max_workers=1)
+    assert [r.error for r in results] == [None,None]
+    with zipfile.ZipFile(tmp_path / 'line.zip') as z:
+        assert sorted(z.namelist()) == ['b_FB.xml','b_FB_DB.xml','c_FB.xml','manifest.json']
+        manifest = json.loads(z.read('manifest.json'))
+    assert {m['file']:m.get('fb_nr',m.get('db_nr')) for m in manifest} == {'b_FB.xml':5,'b_FB_DB.xml':7,'c_FB.xml':6}
+
+
+def test_bundle_rejects_split(tmp_path):
+    jobs = [graph2LAD.ExportJob(EVENTS,'INIT','B',str(tmp_path / 'b_FB'),5,{'split':'prefix'})]
+    with pytest.raises(ValueError,match='Split jobs cannot be bundled'):
+        graph2LAD.export_bundle(jobs,str(tmp_path / 'line.zip'),max_workers=1)
+    assert not (tmp_path / 'line.zip').exists()
@@ -0,0 +1,71 @@
+"""
+Checks that import_fb reads back what export_graph wrote and that diff_fb
+finds the changes of a new design
+"""
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import graph2LAD
+from graph2LAD import Event
+import simatic_import
+
+TITLE = 'Line & <Station> "3"'
+EVENTS = [Event('INIT','GOTO_HOME','init to home'),
+          Event('GOTO_HOME','AT_HOME_POS','Reached home pos'),
+          Event('AT_HOME_POS','LOADING','Start loading'),
+          Event('LOADING','WORKING','Loading completed'),
+          Event('WORKING','UNLOADING','Work complete',priority=1),
+          Event('WORKING','INIT','Abort'),
+          Event('UNLOADING','AT_HOME_POS','Unloading complete'),
+          Event('INIT','UNLOADING','Direct unloading',priority=2)]
+
+# export_graph options of the round trip tests
+OPTIONS = [{},
+           {'language':'SCL'},
+           {'instrument':True},
+           {'state_flags':True},
+           {'stations':3,'station_db':io.BytesIO()}]
+
+
+def _import(**options):
+    data = graph2LAD.export_graph(EVENTS,'INIT',TITLE,None,45,deterministic=True,**options)
+    return simatic_import.import_fb(io.BytesIO(data))
+
+
+@pytest.mark.parametrize('options',OPTIONS,ids=str)
+def test_round_trip(options):
+    fb = _import(**options)
+    graph = graph2LAD.TransitionGraph(EVENTS,clean=True)
+    states = graph.sorted_states('INIT')
+    assert fb.number == 45
+    assert fb.title == TITLE
+    assert fb.init_state == 'INIT'
+    assert fb.states == states
+    assert fb.constants == {s:i*10 for i,s in enumerate(states)}
+    assert fb.other_networks == []
+    # Network order, the order of graph.transitions
+    assert [(e.src,e.dest) for e in fb.events] == \
+           [(e.src,e.dest) for s in states for e in graph.transitions(s)]
+    assert simatic_import.diff_fb(fb,EVENTS,'INIT').unchanged
+
+
+def test_diff_finds_changes():
+    fb = _import()
+    d = simatic_import.diff_fb(fb,EVENTS[:-1] + [Event('LOADING','NEW','New state')],'INIT')
+    assert d.added_states == ['NEW']
+    assert d.added_events == [('LOADING','NEW')]
+    assert d.removed_events == [('INIT','UNLOADING')]
+    assert set(d.changed_states) == {'INIT','LOADING'}
+    assert not d.unchanged
+
+
+def test_diff_init_changed():
+    fb = _import()
+    d = simatic_import.diff_fb(fb,EVENTS,'GOTO_HOME')
+    assert d.init_changed
+    assert 'Init state changed' in d.summary()
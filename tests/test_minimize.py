@@ -0,0 +1,105 @@
+"""
+Checks of minimize and equivalent_states, against a brute-force refinement
+"""
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import graph2LAD
+from graph2LAD import Event
+import minimize
+
+
+def _brute_force(events):
+    """
+    Moore's refinement: states are equivalent when their transitions in network
+    order have the same triggers and lead to equivalent states
+    """
+    graph = graph2LAD.TransitionGraph(events)
+    block = {s:0 for s in graph.states}
+    while True:
+        signature = {s:(block[s],tuple((e.trigger,block[e.dest]) for e in graph.transitions(s)))
+                     for s in graph.states}
+        ids = {}
+        new = {s:ids.setdefault(signature[s],len(ids)) for s in graph.states}
+        if len(ids) == len(set(block.values())):
+            break
+        block = new
+    groups = {}
+    for s in graph.states:
+        groups.setdefault(block[s],set()).add(s)
+    return sorted(sorted(g) for g in groups.values())
+
+
+def _partition(events):
+    graph = graph2LAD.TransitionGraph(events)
+    return sorted(sorted(graph.states[v] for v in b) for b in minimize.equivalent_states(graph))
+
+
+def test_parallel_wait_states_merge():
+    # WAIT_A and WAIT_B wait for the same trigger and continue to the same state
+    events = [Event('INIT','WAIT_A','a'),Event('INIT','WAIT_B','b'),
+              Event('WAIT_A','DONE','ready'),Event('WAIT_B','DONE','ready'),
+              Event('DONE','INIT','ack')]
+    merged,mapping = minimize.minimize(events,'INIT')
+    assert mapping == {'INIT':'INIT','WAIT_A':'WAIT_A','WAIT_B':'WAIT_A','DONE':'DONE'}
+    assert merged == [Event('INIT','WAIT_A','a'),Event('INIT','WAIT_A','b'),
+                      Event('WAIT_A','DONE','ready'),Event('DONE','INIT','ack')]
+
+
+def test_representative_is_first_in_export_order():
+    # B comes before A in the exported order, so A is merged into B
+    events = [Event('INIT','B','x'),Event('INIT','A','y'),
+              Event('A','INIT','t'),Event('B','INIT','t')]
+    order = graph2LAD.TransitionGraph(events).sorted_states('INIT')
+    merged,mapping = minimize.minimize(events,'INIT')
+    first = min('A','B',key=order.index)
+    assert mapping['A'] == mapping['B'] == first
+
+
+def test_init_state_keeps_its_name():
+    # INIT is equivalent to LOOP, the merged state is still INIT
+    events = [Event('INIT','LOOP','t'),Event('LOOP','INIT','t')]
+    merged,mapping = minimize.minimize(events,'INIT')
+    assert mapping == {'INIT':'INIT','LOOP':'INIT'}
+    assert merged == [Event('INIT','INIT','t')]
+
+
+def test_trigger_order_matters():
+    # Same triggers in a different network order react differently when both fire
+    events = [Event('INIT','A','go'),Event('INIT','B','go2'),
+              Event('A','X','t1'),Event('A','Y','t2'),
+              Event('B','Y','t2'),Event('B','X','t1'),
+              Event('X','INIT',''),Event('Y','INIT','')]
+    _,mapping = minimize.minimize(events,'INIT')
+    assert mapping['A'] != mapping['B']
+
+
+def test_different_dest_is_not_merged():
+    events = [Event('INIT','A','go'),Event('INIT','B','go2'),
+              Event('A','X','t'),Event('B','Y','t'),
+              Event('X','INIT','x'),Event('Y','INIT','y')]
+    _,mapping = minimize.minimize(events,'INIT')
+    assert mapping['A'] != mapping['B']
+    assert mapping['X'] != mapping['Y']
+
+
+def test_mapping_covers_all_states():
+    events = [Event('S%d' % i,'S%d' % ((i+1) % 12),'t') for i in range(12)]
+    merged,mapping = minimize.minimize(events,'S0')
+    assert set(mapping) == {'S%d' % i for i in range(12)}
+    assert set(mapping.values()) == {'S0'}
+    assert merged == [Event('S0','S0','t')]
+
+
+@pytest.mark.parametrize('seed',range(200))
+def test_matches_brute_force(seed):
+    r = random.Random(seed)
+    n = r.randint(1,12)
+    events = [Event('S%d' % r.randrange(n),'S%d' % r.randrange(n),r.choice('ab'))
+              for _ in range(r.randint(1,3*n))]
+    assert _partition(events) == _brute_force(events)
@@ -0,0 +1,130 @@
+"""
+Checks of the split export into sub-FBs
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import graph2LAD
+from graph2LAD import Event
+import simatic_import
+
+# Three groups by prefix, the states of a group are not contiguous in the
+# unsplit order because of the cross links
+EVENTS = [Event('INIT','A_1','a'),Event('INIT','B_1','b'),Event('INIT','C_1','c'),
+          Event('A_1','A_2',''),Event('A_2','B_2','x'),Event('A_2','A_3',''),Event('A_3','INIT',''),
+          Event('B_1','B_2',''),Event('B_2','C_2','y'),Event('B_2','INIT',''),
+          Event('C_1','C_2',''),Event('C_2','A_1','z'),Event('C_2','INIT','')]
+
+
+def _groups():
+    graph = graph2LAD.TransitionGraph(EVENTS,clean=True)
+    return graph2LAD._split_groups(graph,'INIT','prefix')
+
+
+def test_groups():
+    groups = _groups()
+    # INIT has no prefix group of its own and is exported first
+    assert groups[0] == ['INIT']
+    assert [sorted(g) for g in groups[1:]] == [['A_1','A_2','A_3'],['B_1','B_2'],['C_1','C_2']]
+
+
+@pytest.fixture
+def split(tmp_path):
+    fname = str(tmp_path / 'line')
+    graph2LAD.export_graph(EVENTS,'INIT','Line',fname,45,split='prefix',sub_fb_nr=100,deterministic=True)
+    return fname
+
+
+def test_sub_fb_numbers(split):
+    groups = _groups()
+    assert simatic_import.import_fb(split + '.xml').number == 45
+    for k in range(len(groups)):
+        fb = simatic_import.import_fb(split + '_' + str(k+1) + '.xml')
+        assert fb.number == 100 + k
+        assert fb.name == 'LINE_' + str(k+1)
+    assert not os.path.exists(split + '_' + str(len(groups)+1) + '.xml')
+
+
+def test_default_sub_fb_numbers(tmp_path):
+    fname = str(tmp_path / 'line')
+    graph2LAD.export_graph(EVENTS,'INIT','Line',fname,45,split='prefix')
+    assert simatic_import.import_fb(fname + '_1.xml').number == 46
+
+
+def test_contiguous_step_ranges(split):
+    # The steps of each group follow each other, so a group is one CASE range
+    groups = _groups()
+    values = {}
+    for k in range(len(groups)):
+        values.update(simatic_import.import_fb(split + '_' + str(k+1) + '.xml').constants)
+    steps = [[values[s] for s in g] for g in groups]
+    flat = [v for g in steps for v in g]
+    assert flat == list(range(0,10*len(flat),10))
+    for g in steps:
+        assert g == list(range(g[0],g[-1]+10,10))
+
+
+def test_dispatch_ranges_match_constants(split):
+    import xml.etree.ElementTree as ET
+    groups = _groups()
+    values = {}
+    for k in range(len(groups)):
+        values.update(simatic_import.import_fb(split + '_' + str(k+1) + '.xml').constants)
+
+    # CASE labels of the dispatch network: first[..last]: followed by the call of statSubK
+    root = ET.parse(split + '.xml').getroot()
+    ranges = []
+    for st in root.iter():
+        if not st.tag.endswith('StructuredText'):
+            continue
+        tokens = simatic_import._scl_tokens(st)
+        if ('var','statStep') not in tokens[:2] or ('token','CASE') != tokens[0]:
+            continue
+        i = 3
+        while i < len(tokens):
+            if tokens[i][0] == 'lit':
+                if tokens[i+1] == ('token','..'):
+                    ranges.append((int(tokens[i][1]),int(tokens[i+2][1])))
+                    i += 3
+                else:
+                    ranges.append((int(tokens[i][1]),int(tokens[i][1])))
+                    i += 1
+            i += 1
+    assert ranges == [(values[g[0]],values[g[-1]]) for g in groups]
+
+
+def test_transitions_across_groups(split):
+    groups = _groups()
+    events = []
+    for k in range(len(groups)):
+        events += simatic_import.import_fb(split + '_' + str(k+1) + '.xml').events
+    graph = graph2LAD.TransitionGraph(EVENTS,clean=True)
+    assert sorted((e.src,e.dest) for e in events) == sorted((e.src,e.dest) for e in graph.events)
+
+
+def test_split_rejects_targets(tmp_path):
+    with pytest.raises(ValueError):
+        graph2LAD.export_graph(EVENTS,'INIT','Line',None,45,split='prefix')
+    with pytest.raises(ValueError):
+        graph2LAD.export_graph(EVENTS,'INIT','Line',str(tmp_path / 'l'),45,split='prefix',
+                               cache_dir=str(tmp_path / 'c'))
+
+
+@pytest.mark.parametrize('size,reserve',[(0,100),(1,100),(100,100),(101,200),(1234,1300)])
+def test_memory_reserve(size,reserve):
+    assert graph2LAD._memory_reserve(size) == reserve
+
+
+def test_interface_bytes():
+    import xml.etree.ElementTree as ET
+    sections = ET.Element('Sections')
+    for name,members in (('Input',[('Bool',1)]),('Static',[('Array[0..9] of LReal',80),('Int',2)]),
+                         ('Temp',[('LReal',0)]),('Constant',[('Int',0)])):
+        section = ET.SubElement(sections,'Section',Name=name)
+        for datatype,_ in members:
+            graph2LAD._create_member(section,'m',datatype)
+    assert graph2LAD._interface_bytes(sections) == 1 + 80 + 2
@@ -0,0 +1,74 @@
+"""
+Checks of trace_analysis, in particular that the result does not depend on
+how the trace is split into chunks
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import trace_analysis
+from graph2LAD import Event
+
+EVENTS = [Event('INIT','GOTO_HOME',''),
+          Event('GOTO_HOME','AT_HOME',''),
+          Event('AT_HOME','WORKING',''),
+          Event('WORKING','AT_HOME','')]
+# INIT 0, GOTO_HOME 10, AT_HOME 20, WORKING 30
+STEPS = [0,0,10,10,10,20,30,30,20,20,30,10,10,0,0,20,35,35,20]
+TIMES = [0.5*i for i in range(len(STEPS))]
+
+
+def _compare(a,b):
+    assert a.samples == b.samples
+    assert a.transitions == b.transitions
+    assert a.illegal == b.illegal
+    assert a.resets == b.resets
+    assert a.unknown_steps == b.unknown_steps
+    for name in ('dwell_count','dwell_total','dwell_min','dwell_max','dwell_hist'):
+        np.testing.assert_array_equal(getattr(a,name),getattr(b,name))
+
+
+def test_report():
+    report = trace_analysis.analyze_trace(EVENTS,'INIT',[(np.array(TIMES),np.array(STEPS))])
+    assert report.samples == len(STEPS)
+    assert report.illegal == {('WORKING','GOTO_HOME'):1,('INIT','AT_HOME'):1}
+    assert report.resets == {'GOTO_HOME':1}
+    assert report.unknown_steps == {35:2}
+    assert not report.ok
+    # Visits cut off by the start and the end of the trace are not counted
+    i = report.states.index('GOTO_HOME')
+    assert report.dwell_count[i] == 2
+    assert report.dwell_total[i] == pytest.approx(1.5 + 1.0)
+    assert report.dwell_min[i] == pytest.approx(1.0)
+    assert report.dwell_max[i] == pytest.approx(1.5)
+
+
+@pytest.mark.parametrize('size',[1,2,3,7,len(STEPS)])
+def test_chunks(size):
+    whole = trace_analysis.analyze_trace(EVENTS,'INIT',[(np.array(TIMES),np.array(STEPS))])
+    chunks = [(np.array(TIMES[k:k+size]),np.array(STEPS[k:k+size])) for k in range(0,len(STEPS),size)]
+    _compare(whole,trace_analysis.analyze_trace(EVENTS,'INIT',chunks))
+
+
+def test_csv_chunks(tmp_path):
+    path = tmp_path / 'trace.csv'
+    with open(path,'w',encoding='utf-8') as f:
+        f.write('time;statStep\n')
+        for t,s in zip(TIMES,STEPS):
+            f.write(str(t) + ';' + str(s) + '\n')
+    whole = trace_analysis.analyze_trace(EVENTS,'INIT',[(np.array(TIMES),np.array(STEPS))])
+    for chunk_bytes in (1,16,1<<20):
+        report = trace_analysis.analyze_trace(EVENTS,'INIT',str(path),time_column='time',delimiter=';',
+                                              chunk_bytes=chunk_bytes)
+        _compare(whole,report)
+
+
+def test_samples_without_time():
+    report = trace_analysis.analyze_trace(EVENTS,'INIT',[(None,np.array(STEPS[:7])),(None,np.array(STEPS[7:]))])
+    i = report.states.index('GOTO_HOME')
+    # 3 samples in the first visit of GOTO_HOME, 2 in the second
+    assert report.dwell_total[i] == 5
@@ -0,0 +1,240 @@
+import numpy as np
+from dataclasses import dataclass, field
+
+from graph2LAD import Event, _as_graph, _clean_str
+
+
+@dataclass
+class TraceReport:
+    """
+    Result of analyze_trace, arrays are indexed like states.
+    Dwell times are in the unit of the time column, or in samples without one.
+    The first and the last visit of the trace are cut off by the recording
+    and are not part of the dwell statistics
+    """
+    states:list
+    step_values:np.ndarray
+    samples:int = 0
+    transitions:dict = field(default_factory=dict)   # (src, dest) -> count, all observed transitions
+    illegal:dict = field(default_factory=dict)       # (src, dest) -> count, transitions that are not events
+    resets:dict = field(default_factory=dict)        # src -> count, transitions to init_state that are not events
+    unknown_steps:dict = field(default_factory=dict) # step value -> samples, values that are not a state
+    dwell_count:np.ndarray = None
+    dwell_total:np.ndarray = None
+    dwell_min:np.ndarray = None
+    dwell_max:np.ndarray = None
+    dwell_hist:np.ndarray = None                     # [state, bin] number of visits per bin of bin_edges
+    bin_edges:np.ndarray = None
+
+    @property
+    def ok(self):
+        return not (self.illegal or self.unknown_steps)
+
+    def dwell_mean(self):
+        with np.errstate(invalid='ignore',divide='ignore'):
+            return np.where(self.dwell_count > 0,self.dwell_total / self.dwell_count,np.nan)
+
+    def dwell_percentile(self,state,q):
+        """
+        Approximate q:th percentile (0-100) of the dwell time of a state from the histogram
+        """
+        i = self.states.index(state)
+        hist = self.dwell_hist[i]
+        if self.dwell_count[i] == 0:
+            return float('nan')
+        k = int(np.searchsorted(np.cumsum(hist),q/100*self.dwell_count[i]))
+        k = min(k,len(hist)-1)
+        # Upper edge of the bin, clipped to the observed range
+        return float(min(max(self.bin_edges[k+1],self.dwell_min[i]),self.dwell_max[i]))
+
+    def summary(self):
+        """
+        Human readable list of the findings
+        """
+        lines = []
+        for (src,dest),n in self.illegal.items():
+            lines.append('Illegal transition: ' + src + ' -> ' + dest + ' (' + str(n) + ')')
+        for value,n in self.unknown_steps.items():
+            lines.append('Unknown step value: ' + str(value) + ' (' + str(n) + ' samples)')
+        mean = self.dwell_mean()
+        for i,s in enumerate(self.states):
+            if self.dwell_count[i] > 0:
+                lines.append('Dwell ' + s + ': n=' + str(int(self.dwell_count[i])) +
+                             ' mean=%g min=%g max=%g' % (mean[i],self.dwell_min[i],self.dwell_max[i]))
+        return lines
+
+
+def read_trace_csv(path,step_column='statStep',time_column=None,delimiter=',',chunk_bytes=1<<24):
+    """
+    Reads a recorded trace in chunks, yields (times, steps) arrays.
+    Columns are header names or 0-based indices, the file has a header line if any column is a name.
+    Without a time column times is None and dwell times are counted in samples.
+    Only one chunk of about chunk_bytes is held in memory at a time
+    """
+    with open(path,encoding='utf-8') as f:
+        columns = [step_column] if time_column is None else [step_column,time_column]
+        if any(isinstance(c,str) for c in columns):
+            header = [h.strip().strip('"') for h in f.readline().rstrip('\r\n').split(delimiter)]
+            try:
+                columns = [header.index(c) if isinstance(c,str) else c for c in columns]
+            except ValueError:
+                raise ValueError('Column not found in ' + str(path) + ': ' + str(columns) + ', header: ' + str(header))
+
+        while True:
+            lines = f.readlines(chunk_bytes)
+            if len(lines) == 0:
+                return
+            data = np.loadtxt(lines,delimiter=delimiter,usecols=columns,ndmin=2,dtype=np.float64)
+            steps = data[:,0].astype(np.int64)
+            times = data[:,1] if time_column is not None else None
+            yield times,steps
+
+
+class TraceAnalyzer:
+    """
+    Accumulates the statistics of a trace chunk by chunk, so traces of any length
+    can be analyzed in bounded memory. Step values are mapped to the states with
+    the numbering of export_graph, the i:th sorted state has step value i*10.
+    A change to init_state that is not an event is counted as a reset.
+    """
+    def __init__(self,events:list[Event],init_state:str,bins=None):
+        graph = _as_graph(events,clean=True)
+        init_state = _clean_str(init_state)
+        self.states = graph.sorted_states(init_state)
+        self.init = 0
+        n = len(self.states)
+        index = {s:i for i,s in enumerate(self.states)}
+
+        # Legal transitions as src*n + dest
+        legal = set()
+        for s in self.states:
+            for e in graph.outgoing_events(s):
+                legal.add(index[s]*n + index[e.dest])
+        self._legal = np.array(sorted(legal),dtype=np.int64)
+
+        if bins is None:
+            # Logarithmic bins from 1 ms to about 3 h, in seconds or samples
+            bins = np.concatenate(([0.0],np.logspace(-3,4,57)))
+        self.bin_edges = np.asarray(bins,dtype=np.float64)
+
+        self.samples = 0
+        self._transitions = {}
+        self._unknown = {}
+        self.dwell_count = np.zeros(n,dtype=np.int64)
+        self.dwell_total = np.zeros(n,dtype=np.float64)
+        self.dwell_min = np.full(n,np.inf)
+        self.dwell_max = np.zeros(n,dtype=np.float64)
+        self.dwell_hist = np.zeros((n,len(self.bin_edges)),dtype=np.int64)
+
+        # Sample the current visit started at, None until the first change
+        self._visit_start = None
+        self._last = None
+
+    def feed(self,times,steps):
+        """
+        Adds a chunk of the trace, times is None to count samples
+        """
+        steps = np.asarray(steps,dtype=np.int64)
+        if len(steps) == 0:
+            return self
+        n = len(self.states)
+        if times is None:
+            times = np.arange(self.samples,self.samples+len(steps),dtype=np.float64)
+        else:
+            times = np.asarray(times,dtype=np.float64)
+        self.samples += len(steps)
+
+        # Step values -> state index, -1 for values that are not a state
+        idx = np.full(len(steps),-1,dtype=np.int64)
+        valid = (steps >= 0) & (steps % 10 == 0) & (steps < n*10)
+        idx[valid] = steps[valid] // 10
+        if not valid.all():
+            values,counts = np.unique(steps[~valid],return_counts=True)
+            for v,c in zip(values.tolist(),counts.tolist()):
+                self._unknown[v] = self._unknown.get(v,0) + c
+
+        # Continue from the last sample of the previous chunk
+        if self._last is not None:
+            idx = np.concatenate(([self._last[0]],idx))
+            times = np.concatenate(([self._last[1]],times))
+
+        change = np.flatnonzero(idx[1:] != idx[:-1]) + 1
+        if len(change) > 0:
+            src = idx[change-1]
+            dest = idx[change]
+            known = (src >= 0) & (dest >= 0)
+            codes,counts = np.unique(src[known]*n + dest[known],return_counts=True)
+            for c,k in zip(codes.tolist(),counts.tolist()):
+                self._transitions[c] = self._transitions.get(c,0) + k
+
+            # A visit lasts from one change to the next, the first one is cut off
+            starts = np.concatenate(([self._visit_start],times[change[:-1]])) if self._visit_start is not None \
+                     else times[change[:-1]]
+            ends = times[change] if self._visit_start is not None else times[change[1:]]
+            visited = src if self._visit_start is not None else src[1:]
+            self._add_dwell(visited,ends - starts)
+            self._visit_start = times[change[-1]]
+
+        self._last = (idx[-1],times[-1])
+        return self
+
+    def _add_dwell(self,visited,dwell):
+        keep = visited >= 0
+        visited = visited[keep]
+        dwell = dwell[keep]
+        if len(visited) == 0:
+            return
+        n = len(self.states)
+        self.dwell_count += np.bincount(visited,minlength=n)
+        self.dwell_total += np.bincount(visited,weights=dwell,minlength=n)
+        np.minimum.at(self.dwell_min,visited,dwell)
+        np.maximum.at(self.dwell_max,visited,dwell)
+        b = np.clip(np.searchsorted(self.bin_edges,dwell,side='right') - 1,0,len(self.bin_edges)-1)
+        np.add.at(self.dwell_hist,(visited,b),1)
+
+    def report(self)->TraceReport:
+        n = len(self.states)
+        legal = set(self._legal.tolist())
+        transitions = {}
+        illegal = {}
+        resets = {}
+        for code,count in sorted(self._transitions.items()):
+            src,dest = divmod(code,n)
+            transitions[(self.states[src],self.states[dest])] = count
+            if code in legal:
+                continue
+            if dest == self.init:
+                resets[self.states[src]] = resets.get(self.states[src],0) + count
+            else:
+                illegal[(self.states[src],self.states[dest])] = count
+
+        return TraceReport(
+            states=list(self.states),
+            step_values=np.arange(n,dtype=np.int32)*10,
+            samples=self.samples,
+            transitions=transitions,
+            illegal=illegal,
+            resets=resets,
+            unknown_steps=dict(sorted(self._unknown.items())),
+            dwell_count=self.dwell_count.copy(),
+            dwell_total=self.dwell_total.copy(),
+            dwell_min=np.where(self.dwell_count > 0,self.dwell_min,np.nan),
+            dwell_max=np.where(self.dwell_count > 0,self.dwell_max,np.nan),
+            dwell_hist=self.dwell_hist.copy(),
+            bin_edges=np.append(self.bin_edges,np.inf),
+        )
+
+
+def analyze_trace(events:list[Event],init_state:str,trace,step_column='statStep',time_column=None,
+                  delimiter=',',chunk_bytes=1<<24,bins=None)->TraceReport:
+    """
+    Analyzes a recorded statStep trace against the events.
+    trace is the path of a CSV file, see read_trace_csv, or an iterable of
+    (times, steps) chunks, e.g. slices of a memory mapped array
+    """
+    analyzer = TraceAnalyzer(events,init_state,bins)
+    if isinstance(trace,str):
+        trace = read_trace_csv(trace,step_column,time_column,delimiter,chunk_bytes)
+    for times,steps in trace:
+        analyzer.feed(times,steps)
+    return analyzer.report()